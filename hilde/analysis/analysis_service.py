@@ -6,13 +6,21 @@ Provides semantic analysis of token alternatives using GPT-4.1-nano
 
 import os
 import json
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+import httpx
+import numpy as np
 import openai
+import orjson
 from dotenv import load_dotenv
 from constraint_debugger import ConstraintDebugger, ConstraintViolation
+from semantic_cache import SemanticCache, RedisSemanticCache
 
 # Load environment variables
 load_dotenv()
@@ -21,13 +29,161 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="HILDE Analysis Service", version="1.0.0")
+app = FastAPI(title="HILDE Analysis Service", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY not found in environment variables")
 
+# Optional constraints.json selecting which debugger rules are enabled
+CONSTRAINTS_FILE = os.getenv("HILDE_CONSTRAINTS_FILE")
+# Worker processes for constraint checks, which are CPU-bound and hold the GIL
+CONSTRAINT_WORKERS = int(os.getenv("HILDE_CONSTRAINT_WORKERS", str(os.cpu_count() or 1)))
+
+# Connection pool size for the OpenAI client
+MAX_CONNECTIONS = 200
+# Concurrent in-flight analyses until the rate limit probe has run
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "16"))
+# Retries (with exponential backoff) for 429 and 5xx responses
+MAX_RETRIES = 3
+# Token alternatives packed into a single chat completion
+DEFAULT_MAX_BATCH = 50
+# Output token budget per packed token alternative
+MAX_TOKENS_PER_PAIR = 300
+# Embedding model for semantic cache keys
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Trailing context characters included in semantic cache keys
+CACHE_CONTEXT_CHARS = 200
+# Redis Stack URL; when set, the semantic cache is shared by all workers
+REDIS_URL = os.getenv("REDIS_URL")
+# Lifetime of shared cache entries, so results drift with constraints and prompts
+REDIS_CACHE_TTL = 86400
+
+# Static system prompt shared byte-for-byte by every analysis request. OpenAI
+# caches prompt prefixes longer than 1024 tokens, so the task description,
+# output schema and worked examples all live here and every per-request
+# field is appended after it in the user message.
+SYSTEM_PREAMBLE = """You are an expert code analyzer for the HILDE system (Human-in-the-Loop Decoding). HILDE shows developers the alternative tokens a code model considered while generating a completion, so they can notice and steer the decisions that matter. Your task is to analyze token alternatives in code and provide structured explanations that help a developer decide whether an alternative deserves attention.
+
+## Input
+
+You will receive:
+- "Base completions": one or more numbered code completions, e.g. "[1] return hashlib.md5(password.encode()).hexdigest()".
+- "Pairs": a numbered list of token alternatives. Each pair names the language, the base completion it belongs to, the original token the model chose ("orig"), the alternative token it could have chosen instead ("alt"), and a short context string describing where the token occurs ("ctx").
+
+Token strings are JSON-encoded, so whitespace, quotes and newlines inside tokens are shown with escapes. Tokens are model sub-word tokens and may be fragments of identifiers, operators or whitespace.
+
+## What to evaluate
+
+For each token alternative, imagine the base completion with the original token replaced by the alternative token and compare the two programs. Provide:
+1. A detailed explanation of how the change affects the code
+2. A concise summary (1-2 lines)
+3. A category: "Significant" (affects behavior/security/efficiency), "Minor" (stylistic), or "Incorrect" (syntax error)
+4. An importance score from 0.0 to 1.0
+
+Focus on security implications, performance impacts, and code correctness. In particular, consider:
+- Security: cryptographic strength (e.g. md5/sha1 versus sha256/scrypt/bcrypt), injection risks (string-built SQL or shell commands versus parameterized calls), unsafe evaluation (eval, exec, pickle), randomness suitable for secrets (random versus secrets), input validation and sanitization, and hardcoded credentials.
+- Correctness: changed comparison or boolean operators (== versus is, and versus or, < versus <=), off-by-one boundaries, changed return values, exception handling, None handling and type mismatches.
+- Performance: algorithmic complexity, repeated work inside loops, unnecessary copies, and blocking I/O.
+- Style: naming, formatting, quoting style and equivalent idioms. These are "Minor".
+
+## Categories
+
+- "Significant": the alternative changes observable behavior, security posture or efficiency in a way a reviewer should consciously decide on.
+- "Minor": the alternative is stylistic or semantically equivalent (renamed variable, different quote style, equivalent idiom).
+- "Incorrect": the alternative would make the code fail to parse or run (syntax error, undefined name, wrong arity).
+
+## Importance score
+
+- 0.8-1.0: security-relevant or clearly changes program results.
+- 0.5-0.8: changes behavior in edge cases or has notable performance impact.
+- 0.2-0.5: small behavioral or readability impact.
+- 0.0-0.2: no meaningful difference, or the tokens are equivalent.
+An "Incorrect" alternative usually scores 0.3-0.6: it matters only in that the developer should not pick it.
+
+## Output schema
+
+Respond with a single JSON object of the form {"results": [...]} containing exactly one result per pair, in the same order, each with the pair's "index". Do not include any text outside the JSON object.
+
+{
+    "results": [
+        {
+            "index": 1,
+            "detailed_explanation": "Detailed analysis of the change...",
+            "explanation_summary": "Brief summary...",
+            "category": "Significant|Minor|Incorrect",
+            "importance_score": 0.75
+        }
+    ]
+}
+
+## Examples
+
+Input:
+Base completions:
+[1] return hashlib.md5(password.encode()).hexdigest()
+
+Pairs:
+1) language=python completion=[1] orig="md5" alt="sha256" ctx=Position 15 in completion
+2) language=python completion=[1] orig="md5" alt="scrypt" ctx=Position 15 in completion
+3) language=python completion=[1] orig="encode" alt="decode" ctx=Position 31 in completion
+
+Output:
+{
+    "results": [
+        {
+            "index": 1,
+            "detailed_explanation": "MD5 is cryptographically broken and fast to brute-force. SHA-256 is collision resistant, but as an unsalted fast hash it is still weak for password storage; a dedicated password hashing function would be better.",
+            "explanation_summary": "Stronger hash than MD5, but still unsalted and fast for passwords.",
+            "category": "Significant",
+            "importance_score": 0.85
+        },
+        {
+            "index": 2,
+            "detailed_explanation": "scrypt is a memory-hard key derivation function designed for password hashing. Note that hashlib.scrypt requires salt, n, r and p arguments, so the surrounding call must change for this to run.",
+            "explanation_summary": "Proper password hashing; needs salt and cost parameters.",
+            "category": "Significant",
+            "importance_score": 0.95
+        },
+        {
+            "index": 3,
+            "detailed_explanation": "str has no decode method in Python 3, so password.decode() raises AttributeError before hashing.",
+            "explanation_summary": "Breaks the code: str has no decode().",
+            "category": "Incorrect",
+            "importance_score": 0.4
+        }
+    ]
+}
+
+Input:
+Base completions:
+[1] if user is None:
+
+Pairs:
+1) language=python completion=[1] orig="is" alt="==" ctx=Position 8 in completion
+2) language=python completion=[1] orig="user" alt="usr" ctx=Position 3 in completion
+
+Output:
+{
+    "results": [
+        {
+            "index": 1,
+            "detailed_explanation": "Comparing to None with == calls __eq__, which user objects may override; 'is None' is the identity check recommended by PEP 8. Behavior is the same for ordinary objects.",
+            "explanation_summary": "Equivalent for most objects; 'is None' is idiomatic.",
+            "category": "Minor",
+            "importance_score": 0.2
+        },
+        {
+            "index": 2,
+            "detailed_explanation": "Renaming the variable only in this expression refers to an undefined name 'usr' unless it is defined elsewhere, raising NameError.",
+            "explanation_summary": "Likely undefined name usr.",
+            "category": "Incorrect",
+            "importance_score": 0.35
+        }
+    ]
+}"""
+
 class AnalysisRequest(BaseModel):
     base_completion: str
     original_token: str
@@ -57,93 +213,333 @@ class ConstraintCheckResponse(BaseModel):
     violations: List[ConstraintViolationResponse]
     summary: Dict[str, Any]
 
+class RateLimiter:
+    """Token bucket throttle for OpenAI requests-per-minute and tokens-per-minute limits"""
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: int):
+        """Wait until both buckets can cover one request of the given token cost"""
+        # Never wait for more than a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                missing_requests = max(0.0, 1 - self.available_requests) / self.requests_per_minute
+                missing_tokens = max(0.0, tokens - self.available_tokens) / self.tokens_per_minute
+                await asyncio.sleep(60 * max(missing_requests, missing_tokens))
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        self.available_requests = min(self.requests_per_minute,
+                                      self.available_requests + elapsed_minutes * self.requests_per_minute)
+        self.available_tokens = min(self.tokens_per_minute,
+                                    self.available_tokens + elapsed_minutes * self.tokens_per_minute)
+
+# Each constraint worker process keeps its own debugger, so its memo survives across requests
+_worker_debugger: Optional[ConstraintDebugger] = None
+
+def _init_constraint_worker(constraints_file: Optional[str]):
+    global _worker_debugger
+    _worker_debugger = ConstraintDebugger(constraints_file=constraints_file)
+
+def _check_code(code: str) -> Tuple[List[ConstraintViolation], Dict[str, Any]]:
+    """Run the constraint debugger on one piece of code inside a worker process"""
+    # The debugger parses only on a memo/cache miss, and only what an incremental edit appended
+    violations = _worker_debugger.analyze_code(code)
+    return violations, _worker_debugger.get_violations_summary()
+
 class HILDEAnalysisEngine:
-    def __init__(self):
+    _decoder = json.JSONDecoder()
+    
+    def __init__(self, max_batch: int = DEFAULT_MAX_BATCH):
         self.model = "gpt-4o-mini"  # Using GPT-4o-mini as a proxy for GPT-4.1-nano
-        self.constraint_debugger = ConstraintDebugger()
+        self.max_batch = max_batch  # Output token budget grows with every packed pair
+        self.constraint_pool = ProcessPoolExecutor(max_workers=CONSTRAINT_WORKERS, initializer=_init_constraint_worker,
+                                                    initargs=(CONSTRAINTS_FILE,))
+        # One pooled client per engine so TCP/TLS connections are reused across requests.
+        # Without a key the service still starts and analyses fall back to heuristics.
+        self.client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY or "not-configured",
+            max_retries=MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_keepalive_connections=100, max_connections=MAX_CONNECTIONS),
+                timeout=30.0
+            )
+        )
+        self.cache = self._create_cache()
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.rate_limiter: Optional[RateLimiter] = None  # Set by probe_rate_limits
     
-    def analyze_token_alternative(self, request: AnalysisRequest) -> AnalysisResponse:
-        """Analyze a token alternative and provide structured explanation"""
+    def _create_cache(self):
+        """Use the shared Redis cache when configured, otherwise an in-process one"""
+        if REDIS_URL:
+            try:
+                return RedisSemanticCache(REDIS_URL, EMBEDDING_MODEL, threshold=0.92, ttl=REDIS_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Redis semantic cache unavailable, using in-process cache: {e}")
+        return SemanticCache(threshold=0.92, gray_threshold=0.80, ttl=3600)
+    
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """Semaphore bounding in-flight OpenAI requests (created on the running loop)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+    
+    async def probe_rate_limits(self):
+        """Size concurrency and throttling from the account's rate limits"""
         try:
-            prompt = self._build_analysis_prompt(request)
-            
-            response = openai.ChatCompletion.create(
+            raw = await self.client.chat.completions.with_raw_response.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1
             )
+            requests_per_minute = int(raw.headers.get("x-ratelimit-limit-requests", 0))
+            tokens_per_minute = int(raw.headers.get("x-ratelimit-limit-tokens", 0))
+        except Exception as e:
+            logger.warning(f"Rate limit probe failed, keeping concurrency at {self.max_concurrency}: {e}")
+            return
+        
+        if requests_per_minute > 0:
+            # Roughly one second's worth of the per-minute budget in flight at once
+            self.max_concurrency = max(1, min(requests_per_minute // 60, MAX_CONNECTIONS))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            logger.info(f"Analysis concurrency set to {self.max_concurrency} ({requests_per_minute} RPM)")
+        
+        if requests_per_minute > 0 and tokens_per_minute > 0:
+            # Throttle proactively instead of backing off after 429s
+            self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    
+    async def analyze_token_alternative(self, request: AnalysisRequest) -> AnalysisResponse:
+        """Analyze a token alternative and provide structured explanation"""
+        return (await self.analyze_batch([request]))[0]
+    
+    async def analyze_many(self, requests: List[AnalysisRequest]) -> List[AnalysisResponse]:
+        """Analyze token alternatives concurrently, one chat completion per request"""
+        results = await asyncio.gather(
+            *(self.analyze_token_alternative(request) for request in requests),
+            return_exceptions=True
+        )
+        return [
+            AnalysisResponse.model_construct(
+                detailed_explanation=f"Analysis failed: {str(result)}",
+                explanation_summary="Analysis error",
+                category="Minor",
+                importance_score=0.1
+            ) if isinstance(result, BaseException) else result
+            for result in results
+        ]
+    
+    async def analyze_batch(self, requests: List[AnalysisRequest]) -> List[AnalysisResponse]:
+        """Analyze many token alternatives, packing up to max_batch pairs into each chat completion"""
+        responses: List[Optional[AnalysisResponse]] = [None] * len(requests)
+        
+        # Identical tokens need no analysis (top-k often includes the chosen token itself)
+        candidates = []
+        for i, request in enumerate(requests):
+            if request.original_token == request.alternative_token:
+                responses[i] = self._fallback_analysis(request)
+            else:
+                candidates.append(i)
+        
+        # Serve repeated token swaps from the semantic cache
+        embeddings = await self._embed_cache_keys(requests, candidates) if candidates else None
+        if embeddings is not None:
+            cached = await asyncio.gather(*(
+                self.cache.alookup(self._cache_key(requests[i]), embeddings[i]) for i in candidates
+            ), return_exceptions=True)
+        else:
+            cached = [None] * len(candidates)
+        pending = []
+        for i, hit in zip(candidates, cached):
+            if isinstance(hit, str):
+                responses[i] = AnalysisResponse.model_validate_json(hit)
+            else:
+                if isinstance(hit, BaseException):
+                    logger.warning(f"Semantic cache lookup failed: {hit}")
+                pending.append(i)
+        
+        chunks = [pending[i:i + self.max_batch] for i in range(0, len(pending), self.max_batch)]
+        await asyncio.gather(*(self._analyze_chunk(chunk, requests, responses, embeddings) for chunk in chunks))
+        return responses
+    
+    async def _embed_cache_keys(self, requests: List[AnalysisRequest], indices: List[int]) -> Optional[Dict[int, np.ndarray]]:
+        """Embed the (original, alternative, context) cache keys of the given requests in one call"""
+        keys = [self._cache_key(requests[i]) for i in indices]
+        try:
+            response = await self.client.embeddings.create(model=EMBEDDING_MODEL, input=keys)
+            return {i: np.asarray(item.embedding, dtype=np.float32) for i, item in zip(indices, response.data)}
+        except Exception as e:
+            logger.warning(f"Cache key embedding failed, skipping semantic cache: {e}")
+            return None
+    
+    @staticmethod
+    def _cache_key(request: AnalysisRequest) -> str:
+        return (f"{request.language}\n{request.original_token}\n{request.alternative_token}\n"
+                f"{request.context[-CACHE_CONTEXT_CHARS:]}")
+    
+    async def _analyze_chunk(self, indices: List[int], requests: List[AnalysisRequest],
+                             responses: List[Optional[AnalysisResponse]], embeddings: Optional[Dict[int, np.ndarray]]):
+        """Analyze one packed batch of token alternatives with a single chat completion"""
+        chunk = [requests[i] for i in indices]
+        try:
+            prompt = self._build_analysis_prompt(chunk)
+            max_tokens = max(500, MAX_TOKENS_PER_PAIR * len(chunk))
+            
+            if self.rate_limiter is not None:
+                # Rough estimate of ~4 characters per prompt token plus the output budget
+                await self.rate_limiter.acquire((len(SYSTEM_PREAMBLE) + len(prompt)) // 4 + max_tokens)
+            
+            async with self.semaphore:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self._get_system_prompt()},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=max_tokens,
+                    response_format={"type": "json_object"},
+                    stream=True
+                )
+                content = await self._read_json_stream(stream)
             
             # Parse the response
-            content = response.choices[0].message.content
-            return self._parse_analysis_response(content, request)
+            results = self._parse_analysis_response(content, chunk)
             
         except Exception as e:
             logger.error(f"Analysis failed: {e}")
-            # Return a fallback response
-            return AnalysisResponse(
-                detailed_explanation=f"Analysis failed: {str(e)}",
-                explanation_summary="Analysis error",
-                category="Minor",
-                importance_score=0.1
-            )
+            # Return a fallback response for every pair in the batch
+            for i in indices:
+                responses[i] = AnalysisResponse.model_construct(
+                    detailed_explanation=f"Analysis failed: {str(e)}",
+                    explanation_summary="Analysis error",
+                    category="Minor",
+                    importance_score=0.1
+                )
+            return
+        
+        stores = []
+        for i, result in zip(indices, results):
+            if result is None:
+                # Fallback parsing for any pair the model did not answer
+                responses[i] = self._fallback_analysis(requests[i])
+                continue
+            responses[i] = result
+            if embeddings is not None:
+                stores.append(self.cache.ainsert(self._cache_key(requests[i]), embeddings[i], result.model_dump_json()))
+        
+        for outcome in await asyncio.gather(*stores, return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                logger.warning(f"Semantic cache store failed: {outcome}")
+    
+    async def _read_json_stream(self, stream) -> str:
+        """Accumulate a streamed completion, closing the stream once the root JSON object is complete"""
+        parts: List[str] = []
+        depth = 0
+        in_string = False
+        escaped = False
+        try:
+            async for event in stream:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if not delta:
+                    continue
+                
+                # response_format=json_object guarantees well-formed JSON, so tracking
+                # brace depth outside of string literals is enough to spot the end
+                for position, char in enumerate(delta):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == "\\":
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = True
+                    elif char == "{":
+                        depth += 1
+                    elif char == "}":
+                        depth -= 1
+                        if depth == 0:
+                            # Stop decoding (and billing) trailing tokens
+                            parts.append(delta[:position + 1])
+                            return "".join(parts)
+                parts.append(delta)
+        finally:
+            await stream.close()
+        return "".join(parts)
     
     def _get_system_prompt(self) -> str:
-        return """You are an expert code analyzer for the HILDE system. Your task is to analyze token alternatives in code and provide structured explanations.
-
-For each token alternative, provide:
-1. A detailed explanation of how the change affects the code
-2. A concise summary (1-2 lines)
-3. A category: "Significant" (affects behavior/security/efficiency), "Minor" (stylistic), or "Incorrect" (syntax error)
-4. An importance score from 0.0 to 1.0
-
-Focus on security implications, performance impacts, and code correctness."""
+        return SYSTEM_PREAMBLE
     
-    def _build_analysis_prompt(self, request: AnalysisRequest) -> str:
-        return f"""Analyze this token alternative in {request.language} code:
-
-Context: {request.context}
-Base completion: {request.base_completion}
-Original token: "{request.original_token}"
-Alternative token: "{request.alternative_token}"
-
-Provide your analysis in this exact JSON format:
-{{
-    "detailed_explanation": "Detailed analysis of the change...",
-    "explanation_summary": "Brief summary...",
-    "category": "Significant|Minor|Incorrect",
-    "importance_score": 0.75
-}}"""
+    def _build_analysis_prompt(self, requests: List[AnalysisRequest]) -> str:
+        # Only per-request data goes here; everything static lives in SYSTEM_PREAMBLE
+        # Alternatives from one completion share its text, so each distinct completion is sent once
+        completions = list(dict.fromkeys(request.base_completion for request in requests))
+        completion_ids = {completion: i for i, completion in enumerate(completions, 1)}
+        
+        lines = ["Base completions:"]
+        lines.extend(f"[{i}] {completion}" for i, completion in enumerate(completions, 1))
+        lines.append("")
+        lines.append("Pairs:")
+        for i, request in enumerate(requests, 1):
+            lines.append(
+                f"{i}) language={request.language} completion=[{completion_ids[request.base_completion]}] "
+                f"orig={json.dumps(request.original_token)} alt={json.dumps(request.alternative_token)} "
+                f"ctx={request.context}"
+            )
+        return "\n".join(lines)
     
-    def _parse_analysis_response(self, content: str, request: AnalysisRequest) -> AnalysisResponse:
-        """Parse the LLM response into structured format"""
+    def _parse_analysis_response(self, content: str, requests: List[AnalysisRequest]) -> List[Optional[AnalysisResponse]]:
+        """Parse the LLM response into one structured result per requested pair (None if unanswered)"""
+        results: Dict[int, AnalysisResponse] = {}
         try:
-            # Try to extract JSON from the response
-            if "{" in content and "}" in content:
-                start = content.find("{")
-                end = content.rfind("}") + 1
-                json_str = content[start:end]
-                data = json.loads(json_str)
-                
-                return AnalysisResponse(
-                    detailed_explanation=data.get("detailed_explanation", "No explanation provided"),
-                    explanation_summary=data.get("explanation_summary", "No summary"),
-                    category=data.get("category", "Minor"),
-                    importance_score=float(data.get("importance_score", 0.5))
-                )
+            try:
+                # JSON mode output is normally the bare object
+                data = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # Otherwise parse the first object embedded in surrounding text
+                data, _ = self._decoder.raw_decode(content, content.index("{"))
+            
+            if isinstance(data, dict):
+                for position, item in enumerate(data.get("results", [])):
+                    try:
+                        index = int(item.get("index", position + 1)) - 1
+                        results[index] = AnalysisResponse(
+                            detailed_explanation=item.get("detailed_explanation", "No explanation provided"),
+                            explanation_summary=item.get("explanation_summary", "No summary"),
+                            category=item.get("category", "Minor"),
+                            importance_score=float(item.get("importance_score", 0.5))
+                        )
+                    except Exception as e:
+                        logger.warning(f"Failed to parse analysis result {position}: {e}")
         except Exception as e:
             logger.warning(f"Failed to parse JSON response: {e}")
         
-        # Fallback parsing
-        return self._fallback_analysis(request)
+        return [results.get(i) for i in range(len(requests))]
     
     def _fallback_analysis(self, request: AnalysisRequest) -> AnalysisResponse:
         """Provide fallback analysis when parsing fails"""
+        # Values are built here with the right types, so skip pydantic validation
         if request.original_token == request.alternative_token:
-            return AnalysisResponse(
+            return AnalysisResponse.model_construct(
                 detailed_explanation="No change detected",
                 explanation_summary="No change",
                 category="Minor",
@@ -152,25 +548,26 @@ Provide your analysis in this exact JSON format:
         
         # Basic heuristic analysis
         if len(request.original_token) != len(request.alternative_token):
-            return AnalysisResponse(
+            return AnalysisResponse.model_construct(
                 detailed_explanation=f"Token length changed from {len(request.original_token)} to {len(request.alternative_token)}",
                 explanation_summary="Token length change",
                 category="Minor",
                 importance_score=0.3
             )
         
-        return AnalysisResponse(
+        return AnalysisResponse.model_construct(
             detailed_explanation=f"Token changed from '{request.original_token}' to '{request.alternative_token}'",
             explanation_summary="Token substitution",
             category="Minor",
             importance_score=0.2
         )
     
-    def check_constraints(self, request: ConstraintCheckRequest) -> ConstraintCheckResponse:
+    async def check_constraints(self, request: ConstraintCheckRequest) -> ConstraintCheckResponse:
         """Check code for constraint violations"""
         try:
-            # Analyze code for constraint violations
-            violations = self.constraint_debugger.analyze_code(request.code, request.language)
+            # Analyze code for constraint violations off the event loop, in a worker process
+            loop = asyncio.get_running_loop()
+            violations, summary = await loop.run_in_executor(self.constraint_pool, _check_code, request.code)
             
             # Convert violations to response format
             violation_responses = []
@@ -184,9 +581,6 @@ Provide your analysis in this exact JSON format:
                     code_snippet=violation.code_snippet
                 ))
             
-            # Get summary
-            summary = self.constraint_debugger.get_violations_summary()
-            
             return ConstraintCheckResponse(
                 violations=violation_responses,
                 summary=summary
@@ -205,24 +599,54 @@ Provide your analysis in this exact JSON format:
                 }
             )
 
+    async def check_constraints_batch(self, requests: List[ConstraintCheckRequest]) -> List[ConstraintCheckResponse]:
+        """Check many pieces of code at once, spread across the constraint worker processes"""
+        return await asyncio.gather(*(self.check_constraints(request) for request in requests))
+
 # Initialize the analysis engine
 analysis_engine = HILDEAnalysisEngine()
 
 @app.post("/analysis", response_model=AnalysisResponse)
 async def analyze_token_alternative(request: AnalysisRequest):
     """Analyze a token alternative and provide structured explanation"""
-    return analysis_engine.analyze_token_alternative(request)
+    # Returning a response directly skips FastAPI re-validating the model
+    result = await analysis_engine.analyze_token_alternative(request)
+    return ORJSONResponse(result.model_dump())
+
+@app.post("/analysis/batch", response_model=List[AnalysisResponse])
+async def analyze_token_alternatives_batch(requests: List[AnalysisRequest]):
+    """Analyze many token alternatives, packing them into as few LLM calls as possible"""
+    results = await analysis_engine.analyze_batch(requests)
+    return ORJSONResponse([result.model_dump() for result in results])
 
 @app.post("/constraints", response_model=ConstraintCheckResponse)
 async def check_constraints(request: ConstraintCheckRequest):
     """Check code for constraint violations"""
-    return analysis_engine.check_constraints(request)
+    return await analysis_engine.check_constraints(request)
+
+@app.post("/constraints/batch", response_model=List[ConstraintCheckResponse])
+async def check_constraints_batch(requests: List[ConstraintCheckRequest]):
+    """Check many pieces of code for constraint violations in one request"""
+    results = await analysis_engine.check_constraints_batch(requests)
+    return ORJSONResponse([result.model_dump() for result in results])
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "model": analysis_engine.model}
 
+@app.on_event("startup")
+async def startup_event():
+    """Probe OpenAI rate limits to size analysis concurrency"""
+    await analysis_engine.probe_rate_limits()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cleanup on shutdown"""
+    await analysis_engine.client.close()
+    await analysis_engine.cache.aclose()
+    analysis_engine.constraint_pool.shutdown(cancel_futures=True)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -6,13 +6,23 @@ Analyzes code for specific rule violations using AST parsing
 """
 
 import ast
+import os
+import re
 import json
-from typing import List, Dict, Any
-from dataclasses import dataclass
+import math
+import sys
+import bisect
+import pickle
+import hashlib
+import tempfile
+import functools
+import itertools
+from collections import Counter
+from typing import List, Dict, Any, FrozenSet, Iterable, Iterator, Match, NamedTuple, Optional, Pattern, Set, Tuple
 from pathlib import Path
 
-@dataclass
-class ConstraintViolation:
+class ConstraintViolation(NamedTuple):
+    """Immutable and tuple-backed, so thousands of violations stay compact"""
     rule: str
     line: int
     column: int
@@ -20,10 +30,269 @@ class ConstraintViolation:
     severity: str
     code_snippet: str
 
+# Default location for the on-disk analysis cache
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "hilde" / "ast-cache"
+
+@functools.lru_cache(maxsize=None)
+def _cache_salt() -> bytes:
+    """Cached results are only valid for this exact analyzer source and Python version"""
+    # Computed on first use so importing the module (e.g. for health checks) never reads and hashes it
+    return hashlib.sha256(Path(__file__).read_bytes() + sys.version.encode()).hexdigest().encode()
+
+@functools.lru_cache(maxsize=8)
+def _load_constraints(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a constraints file; the mtime key invalidates the cache when the file changes"""
+    with open(path) as f:
+        return json.load(f)
+
+class _Snapshot(NamedTuple):
+    """State of a clean analysis, kept so appended code can be checked on its own"""
+    code: str
+    config: Tuple[FrozenSet[str], int]
+    trees: List[ast.AST]
+    violations: List[ConstraintViolation]
+    unsanitized_inputs: List[Tuple[ConstraintViolation, str]]
+
+class _RuleVisitor(ast.NodeVisitor):
+    """Single-pass AST visitor that applies every enabled rule as it descends"""
+    
+    INPUT_FUNCS = frozenset({'input', 'raw_input'})
+    STDIN_READERS = frozenset({'read', 'readline', 'readlines'})
+    # File, network, subprocess and parsing calls that routinely raise
+    RISKY_CALLS = frozenset({
+        'open', 'urlopen', 'connect', 'execute', 'executemany', 'loads', 'load',
+        'check_call', 'check_output', 'Popen', 'send', 'sendall', 'recv'
+    })
+    RISKY_PREFIXES = ('execute', 'fetch')  # Database helpers such as execute_query()
+    
+    def __init__(self, debugger: "ConstraintDebugger"):
+        self.debugger = debugger
+        
+        # Decide rule applicability once instead of per node
+        enabled = debugger.enabled_rules
+        self.check_globals = "no_global_vars" in enabled
+        self.check_inputs = "sanitize_inputs" in enabled
+        self.check_function_length = "max_function_length" in enabled
+        self.check_error_handling = "require_error_handling" in enabled
+        
+        # One frame per enclosing function, filled in as its body is visited
+        self.function_frames: List[Dict[str, bool]] = []
+        # Number of enclosing function/class/lambda scopes; 0 means module level
+        self.scope_depth = 0
+        # Filled in during the descent; a node's ancestors are recorded before it is visited
+        self.parents = debugger._parents
+    
+    def generic_visit(self, node: ast.AST):
+        """Descend into child nodes, recording each child's parent on the way"""
+        parents = self.parents
+        for child in ast.iter_child_nodes(node):
+            parents[child] = node
+            self.visit(child)
+    
+    def visit_Assign(self, node: ast.Assign):
+        # Top-level assignments (including in module-level if/for/with/try blocks) are global variables
+        if self.check_globals and self.scope_depth == 0:
+            self.debugger.violations.append(ConstraintViolation(
+                rule="no_global_vars",
+                line=node.lineno,
+                column=node.col_offset,
+                explanation="Global variable declaration found. Global variables can cause hidden side effects and make code harder to test and maintain.",
+                severity="warning",
+                code_snippet=self.debugger._line(node.lineno).strip()
+            ))
+        self.generic_visit(node)
+    
+    def visit_Call(self, node: ast.Call):
+        # Check if it's an input function call
+        if self.check_inputs and self._is_input_call(node.func):
+            # Check if the input is assigned to a variable and if it's sanitized
+            # Look for patterns like: variable = input("prompt")
+            # and check if the variable is later sanitized
+            var_name = self.debugger._input_target(node)
+            if var_name is None or not self.debugger._find_sanitization(var_name):
+                violation = ConstraintViolation(
+                    rule="sanitize_inputs",
+                    line=node.lineno,
+                    column=node.col_offset,
+                    explanation="User input not properly sanitized. User inputs should be sanitized to prevent injection attacks and data corruption.",
+                    severity="error",
+                    code_snippet=self.debugger._line(node.lineno).strip()
+                )
+                self.debugger.violations.append(violation)
+                if var_name is not None:
+                    # Code appended later may still sanitize this variable
+                    self.debugger._unsanitized_inputs.append((violation, var_name))
+        if self.function_frames:
+            name = self._call_name(node.func)
+            if name and (name in self.RISKY_CALLS or name.startswith(self.RISKY_PREFIXES)):
+                self.function_frames[-1]['has_risky'] = True
+        self.generic_visit(node)
+    
+    def visit_BinOp(self, node: ast.BinOp):
+        # Division can raise ZeroDivisionError
+        if self.function_frames and isinstance(node.op, (ast.Div, ast.FloorDiv)):
+            self.function_frames[-1]['has_risky'] = True
+        self.generic_visit(node)
+    
+    def visit_Try(self, node: ast.AST):
+        if self.function_frames:
+            self.function_frames[-1]['has_try'] = True
+        self.generic_visit(node)
+    
+    def visit_TryStar(self, node: ast.AST):
+        # except* blocks (Python 3.11+)
+        self.visit_Try(node)
+    
+    @staticmethod
+    def _call_name(func: ast.expr) -> Optional[str]:
+        if isinstance(func, ast.Name):
+            return func.id
+        if isinstance(func, ast.Attribute):
+            return func.attr
+        return None
+    
+    def _is_input_call(self, func: ast.expr) -> bool:
+        """Match input()/raw_input() and sys.stdin.read()/readline()/readlines()"""
+        if isinstance(func, ast.Name):
+            return func.id in self.INPUT_FUNCS
+        if isinstance(func, ast.Attribute) and func.attr in self.STDIN_READERS:
+            stream = func.value
+            return (isinstance(stream, ast.Attribute) and stream.attr == 'stdin'
+                    and isinstance(stream.value, ast.Name) and stream.value.id == 'sys')
+        return False
+    
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        self._visit_function(node, "def")
+    
+    def _visit_function(self, node: ast.AST, keyword: str):
+        """Visit a sync or async function, checking its length and error handling"""
+        if self.check_function_length:
+            # Calculate function length using line numbers
+            function_start = node.lineno
+            function_end = self.debugger._get_function_end_line(node)
+            function_length = function_end - function_start + 1
+            max_length = self.debugger.max_function_length
+            
+            if function_length > max_length:
+                self.debugger.violations.append(ConstraintViolation(
+                    rule="max_function_length",
+                    line=function_start,
+                    column=node.col_offset,
+                    explanation=f"Function '{node.name}' is {function_length} lines long, exceeding the maximum of {max_length} lines. Long functions are hard to maintain and should be broken into smaller functions.",
+                    severity="warning",
+                    code_snippet=f"{keyword} {node.name}(...):"
+                ))
+        
+        if not self.check_error_handling:
+            self._visit_scope(node)
+            return
+        
+        # Nested functions get their own frame; an outer try doesn't cover them
+        self.function_frames.append({'has_try': False, 'has_risky': False})
+        self._visit_scope(node)
+        frame = self.function_frames.pop()
+        if frame['has_risky'] and not frame['has_try']:
+            self.debugger.violations.append(ConstraintViolation(
+                rule="require_error_handling",
+                line=node.lineno,
+                column=node.col_offset,
+                explanation=f"Function '{node.name}' performs file, network, database, parsing or division operations without a try/except. Functions should include proper error handling to prevent unexpected crashes.",
+                severity="warning",
+                code_snippet=f"{keyword} {node.name}(...):"
+            ))
+    
+    def _visit_scope(self, node: ast.AST):
+        """Visit the body of a function, class or lambda, none of which is module level"""
+        self.scope_depth += 1
+        self.generic_visit(node)
+        self.scope_depth -= 1
+    
+    # Defined as methods rather than aliases so the class stays compilable with mypyc
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef):
+        self._visit_function(node, "async def")
+    
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self._visit_scope(node)
+    
+    def visit_Lambda(self, node: ast.Lambda):
+        self._visit_scope(node)
+
 class ConstraintDebugger:
-    def __init__(self):
-        self.violations = []
+    RULES = ("no_global_vars", "sanitize_inputs", "max_function_length", "disallow_raw_sql", "no_hardcoded_secrets",
+             "require_error_handling")
+    # Applied unless configured otherwise; the rest are opt-in through the constraints file
+    DEFAULT_RULES = ("no_global_vars", "sanitize_inputs", "max_function_length")
+    
+    # One alternation per rule, compiled once; m.lastgroup says which pattern matched
+    _SQL_RE = re.compile(
+        r"(?P<select>\bSELECT\s+.+?\s+FROM\b)"
+        r"|(?P<insert>\bINSERT\s+INTO\b)"
+        r"|(?P<update>\bUPDATE\s+\w+\s+SET\b)"
+        r"|(?P<delete>\bDELETE\s+FROM\b)"
+        r"|(?P<drop>\bDROP\s+TABLE\b)",
+        re.IGNORECASE
+    )
+    # String concatenation, %-formatting, str.format or f-strings on the same line
+    _DYNAMIC_STRING_RE = re.compile(r"""\+|%|\.format\(|\b[fF][rR]?["']""")
+    # Whole-source prefilter: every _SQL_RE match starts with one of these keywords
+    _SQL_KEYWORD_RE = re.compile(r"\b(?:SELECT|INSERT|UPDATE|DELETE|DROP)\b", re.IGNORECASE)
+    _SECRETS_RE = re.compile(
+        r"""(?P<password>\b\w*passw(?:or)?d\w*["']?(?:\s*=\s*|\s*:\s*)["'][^"']+["'])"""
+        r"""|(?P<api_key>\b\w*api_?key\w*["']?(?:\s*=\s*|\s*:\s*)["'][^"']+["'])"""
+        r"""|(?P<secret>\b\w*secret\w*["']?(?:\s*=\s*|\s*:\s*)["'][^"']+["'])"""
+        r"""|(?P<token>\b\w*token\w*["']?(?:\s*=\s*|\s*:\s*)["'][^"']+["'])"""
+        r"""|(?P<private_key>-----BEGIN (?:RSA |EC |DSA )?PRIVATE KEY-----)""",
+        re.IGNORECASE
+    )
+    # Whole-source prefilter: every _SECRETS_RE match has a separator then a quote, or a PEM header
+    _QUOTED_VALUE_RE = re.compile(r"""[=:][^\S\n]*["']|-----BEGIN""")
+    _QUOTED_RE = re.compile(r"""["']([^"']+)["']\s*$""")
+    _NEWLINE_RE = re.compile(r"\n")
+    # .strip(), .lower(), .upper(), .replace( or any escape/sanitize/validate helper, in one scan
+    _SANITIZE_RE = re.compile(r"\.(?:strip\(\)|lower\(\)|upper\(\)|replace\()|escape|sanitize|validate")
+    # Shannon entropy (bits/char) below which a keyed string literal is taken
+    # for a placeholder or identifier rather than a generated credential
+    SECRET_MIN_ENTROPY = 3.5
+    # Recent results kept in memory for repeated identical payloads (retries, polling)
+    MEMO_SIZE = 512
+    
+    def __init__(self, enabled_rules: Optional[Iterable[str]] = None, constraints_file: Optional[str] = None,
+                 cache_dir: Optional[str] = None):
+        """
+        Args:
+            enabled_rules: Rules to apply; defaults to the constraints file, or DEFAULT_RULES
+            constraints_file: JSON config whose "enabled" flags select rules, reloaded when it changes
+            cache_dir: Directory for persisting results of unchanged sources (e.g. DEFAULT_CACHE_DIR)
+        """
+        self.violations: List[ConstraintViolation] = []
         self.max_function_length = 20  # Configurable limit for function length
+        self.constraints_file = None if enabled_rules is not None else constraints_file
+        self._constraints_mtime_ns: Optional[int] = None
+        self.enabled_rules = frozenset(self.DEFAULT_RULES if enabled_rules is None else enabled_rules)
+        self._code = ""  # Source being analyzed; lines are sliced out on demand
+        self._line_starts: List[int] = []  # Offset of each line in the source
+        self._parents: Dict[ast.AST, ast.AST] = {}  # Parent of each node in the parsed tree
+        self._sanitized_names: Optional[Set[str]] = None  # Built on the first input site per analysis
+        self._trees: List[ast.AST] = []  # Parsed module, plus any appended parts parsed separately
+        self._unsanitized_inputs: List[Tuple[ConstraintViolation, str]] = []  # Assigned inputs flagged so far
+        self._snapshot: Optional[_Snapshot] = None  # Last clean analysis, reused when code is appended to it
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        # Insertion-ordered, most recently used last
+        self._memo: Dict[Tuple[str, FrozenSet[str], int], List[ConstraintViolation]] = {}
+        self._refresh_enabled_rules()
+    
+    def _refresh_enabled_rules(self):
+        """Re-derive enabled rules if the constraints file changed since the last call"""
+        if not self.constraints_file:
+            return
+        mtime_ns = os.stat(self.constraints_file).st_mtime_ns
+        if mtime_ns == self._constraints_mtime_ns:
+            return
+        constraints = _load_constraints(self.constraints_file, mtime_ns).get("constraints", {})
+        self.enabled_rules = frozenset(
+            name for name in self.RULES if constraints.get(name, {}).get("enabled", name in self.DEFAULT_RULES)
+        )
+        self._constraints_mtime_ns = mtime_ns
     
     def analyze_code(self, code: str) -> List[ConstraintViolation]:
         """
@@ -35,23 +304,144 @@ class ConstraintDebugger:
         Returns:
             List of constraint violations found
         """
+        self._refresh_enabled_rules()
+        memo_key = (code, self.enabled_rules, self.max_function_length)
+        memoized = self._memo.pop(memo_key, None)
+        if memoized is not None:
+            self._memo[memo_key] = memoized
+            self.violations = list(memoized)
+            return self.violations
+        
+        cache_path = self._cache_path(self.cache_dir, code) if self.cache_dir else None
+        cached = self._load_cached(cache_path) if cache_path is not None else None
+        if cached is not None:
+            self.violations = cached
+        else:
+            self._analyze_uncached(code)
+            if cache_path is not None:
+                self._store_cached(cache_path, self.violations)
+        
+        self._memo[memo_key] = list(self.violations)
+        if len(self._memo) > self.MEMO_SIZE:
+            del self._memo[next(iter(self._memo))]
+        return self.violations
+
+    def get_violations_summary(self) -> Dict[str, Any]:
+        """Summarize the violations from the last analysis by severity and rule"""
+        return {
+            "total_violations": len(self.violations),
+            "status": "violations_found" if self.violations else "clean",
+            "by_severity": dict(Counter(v.severity for v in self.violations)),
+            "by_rule": dict(Counter(v.rule for v in self.violations)),
+        }
+
+    def _analyze_uncached(self, code: str):
+        """Run every enabled rule over the source, filling self.violations"""
+        snapshot, self._snapshot = self._snapshot, None
         self.violations = []
+        # Index line offsets once instead of materializing every line as a string
+        self._code = code
+        self._line_starts = [0]
+        self._line_starts.extend(match.end() for match in self._NEWLINE_RE.finditer(code))
+        
+        # Parsing happens only here, on a memo/cache miss, and only for what was appended when possible
+        if snapshot is not None and self._extends(snapshot, code):
+            try:
+                self._analyze_appended(snapshot, code)
+                return
+            except SyntaxError:
+                # Let the full parse report the error against the whole source
+                self.violations = []
         self._analyze_python_code(code)
-        return self.violations
+    
+    def _extends(self, snapshot: "_Snapshot", code: str) -> bool:
+        """Whether code is the snapshot's source followed by new top-level statements"""
+        if snapshot.config != (self.enabled_rules, self.max_function_length):
+            return False
+        if not (snapshot.code.endswith('\n') and len(code) > len(snapshot.code) and code.startswith(snapshot.code)):
+            return False
+        suffix = code[len(snapshot.code):]
+        if '__future__' in suffix:
+            return False  # Only valid at the top of the whole module
+        # The first non-blank appended line must be unindented, or it could continue the last block
+        for line in suffix.split('\n', 64):
+            if line.strip():
+                return not line[0].isspace()
+        return False
+    
+    def _analyze_appended(self, snapshot: "_Snapshot", code: str):
+        """Check only the statements appended after a previously analyzed prefix"""
+        prefix_length = len(snapshot.code)
+        # Pad with the prefix's line count so node line numbers refer to the whole source
+        tree = ast.parse('\n' * snapshot.code.count('\n') + code[prefix_length:])
+        self._trees = snapshot.trees + [tree]
+        self._parents = {}
+        self._sanitized_names = None
+        self._unsanitized_inputs = []
+        _RuleVisitor(self).visit(tree)
+        if "disallow_raw_sql" in self.enabled_rules:
+            self._check_raw_sql(code, prefix_length)
+        if "no_hardcoded_secrets" in self.enabled_rules:
+            self._check_hardcoded_secrets(code, prefix_length)
+        
+        # Prefix findings stand, except inputs the appended code now sanitizes
+        cleared = set()
+        for violation, var_name in snapshot.unsanitized_inputs:
+            if self._find_sanitization(var_name):
+                cleared.add(id(violation))
+            else:
+                self._unsanitized_inputs.append((violation, var_name))
+        self.violations = [v for v in snapshot.violations if id(v) not in cleared] + self.violations
+        self._take_snapshot(code)
+    
+    def _take_snapshot(self, code: str):
+        self._snapshot = _Snapshot(code, (self.enabled_rules, self.max_function_length), self._trees,
+                                   list(self.violations), list(self._unsanitized_inputs))
+    
+    def _cache_path(self, cache_dir: Path, code: str) -> Path:
+        """Cache file for this source under the current rule configuration"""
+        key = hashlib.sha256()
+        key.update(_cache_salt())
+        key.update(f"{sorted(self.enabled_rules)}:{self.max_function_length}\n".encode())
+        key.update(code.encode())
+        return cache_dir / f"{key.hexdigest()}.pkl"
+    
+    def _load_cached(self, path: Path) -> Optional[List[ConstraintViolation]]:
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # Missing, corrupt or incompatible entries are recomputed and overwritten
+            return None
+    
+    def _store_cached(self, path: Path, violations: List[ConstraintViolation]):
+        """Persist results for other worker processes; they load the file whole or not at all"""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(violations, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # The cache is an optimization; analysis results are already in hand
     
     def _analyze_python_code(self, code: str):
-        """Analyze Python code using AST for three specific checks"""
+        """Analyze Python code using AST, applying all rules in a single traversal"""
         try:
             tree = ast.parse(code)
+            self._trees = [tree]
+            # The visitor fills in the child -> parent map as it descends
+            self._parents = {}
+            self._sanitized_names = None
+            self._unsanitized_inputs = []
+            _RuleVisitor(self).visit(tree)
             
-            # Check for global variables
-            self._check_global_variables(tree, code)
-            
-            # Check for input sanitization
-            self._check_input_sanitization(tree, code)
-            
-            # Check for function length
-            self._check_max_function_length(tree, code)
+            # Line-based checks
+            if "disallow_raw_sql" in self.enabled_rules:
+                self._check_raw_sql(code)
+            if "no_hardcoded_secrets" in self.enabled_rules:
+                self._check_hardcoded_secrets(code)
+            self._take_snapshot(code)
         
         except SyntaxError as e:
             # If code has syntax errors, add a violation
@@ -61,138 +451,107 @@ class ConstraintDebugger:
                 column=e.offset or 0,
                 explanation=f"Syntax error in code: {e.msg}",
                 severity="error",
-                code_snippet=code.split('\n')[e.lineno - 1] if e.lineno else ""
+                code_snippet=self._line(e.lineno) if e.lineno else ""
             ))
     
-    def _check_global_variables(self, tree: ast.AST, code: str):
-        """Check for global variable declarations"""
-        lines = code.split('\n')
-        
-        # Check for top-level assignments (global variables)
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Assign):
-                # Check if this assignment is at module level (not inside a function/class)
-                if self._is_module_level(node, tree):
-                    line_num = node.lineno
-                    line_content = lines[line_num - 1] if line_num <= len(lines) else ""
-                    
-                    self.violations.append(ConstraintViolation(
-                        rule="no_global_vars",
-                        line=line_num,
-                        column=node.col_offset,
-                        explanation="Global variable declaration found. Global variables can cause hidden side effects and make code harder to test and maintain.",
-                        severity="warning",
-                        code_snippet=line_content.strip()
-                    ))
-    
-    def _is_module_level(self, node: ast.AST, tree: ast.AST) -> bool:
-        """Check if a node is at module level (not inside function/class)"""
-        for parent in ast.walk(tree):
-            if hasattr(parent, 'body'):
-                if node in parent.body:
-                    # If parent is a function or class, this is not module level
-                    if isinstance(parent, (ast.FunctionDef, ast.ClassDef)):
-                        return False
-                    # If parent is the module itself, this is module level
-                    elif isinstance(parent, ast.Module):
-                        return True
-        return True
-    
-    def _check_input_sanitization(self, tree: ast.AST, code: str):
-        """Check for proper input sanitization"""
-        lines = code.split('\n')
-        
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Call):
-                # Check if it's an input function call
-                if isinstance(node.func, ast.Name) and node.func.id == 'input':
-                    line_num = node.lineno
-                    line_content = lines[line_num - 1] if line_num <= len(lines) else ""
-                    
-                    # Check if the input is assigned to a variable and if it's sanitized
-                    # Look for patterns like: variable = input("prompt")
-                    # and check if the variable is later sanitized
-                    is_sanitized = self._check_input_sanitization_context(node, tree, lines)
-                    
-                    if not is_sanitized:
-                        self.violations.append(ConstraintViolation(
-                            rule="sanitize_inputs",
-                            line=line_num,
-                            column=node.col_offset,
-                            explanation="User input not properly sanitized. User inputs should be sanitized to prevent injection attacks and data corruption.",
-                            severity="error",
-                            code_snippet=line_content.strip()
-                        ))
-    
-    def _check_input_sanitization_context(self, input_node: ast.Call, tree: ast.AST, lines: List[str]) -> bool:
-        """Check if input is properly sanitized in its context"""
-        # Look for the parent assignment
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Assign):
-                if input_node in ast.walk(node):
-                    # Check if the assigned variable is sanitized later
-                    for target in node.targets:
-                        if isinstance(target, ast.Name):
-                            var_name = target.id
-                            # Look for sanitization of this variable
-                            return self._find_sanitization(var_name, tree, lines)
-        return False
+    def _line(self, line_num: int) -> str:
+        """Return a 1-based source line, or an empty string if out of range"""
+        if not 0 < line_num <= len(self._line_starts):
+            return ""
+        start = self._line_starts[line_num - 1]
+        # Exclude the newline that ends the line (the last line has none)
+        end = self._line_starts[line_num] - 1 if line_num < len(self._line_starts) else len(self._code)
+        return self._code[start:end]
+    
+    def _scan(self, prefilter: Pattern[str], pattern: Pattern[str], code: str,
+              start: int = 0) -> Iterator[Tuple[int, str, Match[str]]]:
+        """
+        Locate candidate lines with one prefilter pass over the whole source, then yield
+        (line number, line, match) for the first match of pattern on each non-comment candidate
+        """
+        last_line = 0
+        for hit in prefilter.finditer(code, start):
+            line_num = bisect.bisect_right(self._line_starts, hit.start())
+            if line_num == last_line:
+                continue
+            last_line = line_num
+            line = self._line(line_num)
+            if line.lstrip().startswith('#'):
+                continue
+            match = pattern.search(line)
+            if match:
+                yield line_num, line, match
+    
+    def _check_raw_sql(self, code: str, start: int = 0):
+        """Check for SQL statements built from dynamic strings"""
+        for line_num, line, match in self._scan(self._SQL_KEYWORD_RE, self._SQL_RE, code, start):
+            if self._DYNAMIC_STRING_RE.search(line):
+                self.violations.append(ConstraintViolation(
+                    rule="disallow_raw_sql",
+                    line=line_num,
+                    column=match.start(),
+                    explanation=f"Raw SQL {str(match.lastgroup).upper()} query built from dynamic strings. Raw SQL queries are vulnerable to SQL injection attacks. Use parameterized queries instead.",
+                    severity="error",
+                    code_snippet=line.strip()
+                ))
+    
+    def _check_hardcoded_secrets(self, code: str, start: int = 0):
+        """Check for credentials assigned as string literals"""
+        for line_num, line, match in self._scan(self._QUOTED_VALUE_RE, self._SECRETS_RE, code, start):
+            kind = str(match.lastgroup)  # Every alternative is a named group
+            if kind in ('api_key', 'secret', 'token'):
+                # Generated keys look random; names like token_type = "bearer" don't
+                value = self._QUOTED_RE.search(match.group())
+                if value and self._shannon_entropy(value.group(1)) < self.SECRET_MIN_ENTROPY:
+                    continue
+            self.violations.append(ConstraintViolation(
+                rule="no_hardcoded_secrets",
+                line=line_num,
+                column=match.start(),
+                explanation=f"Hardcoded {kind.replace('_', ' ')} found. Hardcoded secrets in source code are a security risk. Use environment variables or secure configuration.",
+                severity="error",
+                code_snippet=line.strip()
+            ))
     
-    def _find_sanitization(self, var_name: str, tree: ast.AST, lines: List[str]) -> bool:
+    @staticmethod
+    def _shannon_entropy(value: str) -> float:
+        """Shannon entropy of a string in bits per character"""
+        length = len(value)
+        return -sum(count / length * math.log2(count / length) for count in Counter(value).values())
+    
+    def _input_target(self, input_node: ast.Call) -> Optional[str]:
+        """Name of the variable an input call is assigned to, if any (only those can be sanitized later)"""
+        # Climb to the statement containing the call
+        parent = self._parents.get(input_node)
+        while parent is not None and not isinstance(parent, ast.stmt):
+            parent = self._parents.get(parent)
+        if isinstance(parent, ast.Assign):
+            for target in parent.targets:
+                if isinstance(target, ast.Name):
+                    return target.id
+        return None
+    
+    def _find_sanitization(self, var_name: str) -> bool:
         """Find if a variable is sanitized"""
-        sanitization_methods = ['.strip()', '.lower()', '.upper()', '.replace(', 'escape', 'sanitize', 'validate']
-        
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Name) and node.id == var_name:
-                # Check if this variable is used in a sanitization context
-                line_num = node.lineno
-                if line_num <= len(lines):
-                    line_content = lines[line_num - 1]
-                    if any(method in line_content for method in sanitization_methods):
-                        return True
-        return False
+        if self._sanitized_names is None:
+            # One walk answers every input site: names used on a line with a sanitization call
+            sanitized_lines: Dict[int, bool] = {}
+            self._sanitized_names = set()
+            for node in itertools.chain.from_iterable(ast.walk(tree) for tree in self._trees):
+                # Exact type check; Name nodes are never subclassed
+                if type(node) is ast.Name and node.id not in self._sanitized_names:
+                    line_num = node.lineno
+                    if line_num not in sanitized_lines:
+                        line_content = self._line(line_num)
+                        sanitized_lines[line_num] = self._SANITIZE_RE.search(line_content) is not None
+                    if sanitized_lines[line_num]:
+                        self._sanitized_names.add(node.id)
+        return var_name in self._sanitized_names
     
-    def _check_max_function_length(self, tree: ast.AST, code: str):
-        """Check for functions that exceed maximum length"""
-        lines = code.split('\n')
-        
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                # Calculate function length using line numbers
-                function_start = node.lineno
-                
-                # Find the last line of the function
-                function_end = self._get_function_end_line(node, lines)
-                function_length = function_end - function_start + 1
-                
-                if function_length > self.max_function_length:
-                    self.violations.append(ConstraintViolation(
-                        rule="max_function_length",
-                        line=function_start,
-                        column=node.col_offset,
-                        explanation=f"Function '{node.name}' is {function_length} lines long, exceeding the maximum of {self.max_function_length} lines. Long functions are hard to maintain and should be broken into smaller functions.",
-                        severity="warning",
-                        code_snippet=f"def {node.name}(...):"
-                    ))
-    
-    def _get_function_end_line(self, function_node: ast.FunctionDef, lines: List[str]) -> int:
+    def _get_function_end_line(self, function_node: ast.AST) -> int:
         """Get the last line number of a function"""
-        # Start with the function's own line number
-        last_line = function_node.lineno
-        
-        # Walk through all nodes in the function to find the last line
-        for node in ast.walk(function_node):
-            if hasattr(node, 'lineno') and node.lineno > last_line:
-                last_line = node.lineno
-        
-        # If we couldn't find a better end line, estimate based on indentation
-        if last_line == function_node.lineno and function_node.body:
-            # Look for the last statement in the function body
-            last_stmt = function_node.body[-1]
-            if hasattr(last_stmt, 'lineno'):
-                last_line = last_stmt.lineno
-        
-        return last_line
+        # Python 3.8+ records where every node ends, including multi-line final statements
+        return function_node.end_lineno or function_node.lineno
 
 # Example usage
 if __name__ == "__main__":
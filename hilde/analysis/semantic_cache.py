@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+HILDE Semantic Cache
+Nearest-neighbour caches for LLM analysis results, keyed by embedding
+In-process by default; Redis-backed when results should be shared across workers
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.92, gray_threshold: float = 0.80,
+                 ttl: float = 3600.0, max_entries: int = 10000):
+        """
+        Initialize an empty cache
+
+        Args:
+            threshold: Cosine similarity at or above which a stored result is returned
+            gray_threshold: Similarity above which a miss is counted as a near miss
+            ttl: Seconds before an entry expires (constraints and prompts drift)
+            max_entries: Oldest entries are evicted beyond this size
+        """
+        self.threshold = threshold
+        self.gray_threshold = gray_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._embeddings: Optional[np.ndarray] = None
+        self._created: List[float] = []
+        self._values: List[Any] = []
+        self.stats: Dict[str, int] = {"hits": 0, "near_misses": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Any]:
+        """Return the stored value for the most similar embedding, if similar enough"""
+        self._evict_expired()
+        if not self._values:
+            self.stats["misses"] += 1
+            return None
+
+        similarities = self._embeddings @ self._normalize(embedding)
+        best = int(np.argmax(similarities))
+        score = float(similarities[best])
+
+        if score >= self.threshold:
+            self.stats["hits"] += 1
+            return self._values[best]
+
+        # Near misses still go to the LLM; tracked to tune the threshold
+        self.stats["near_misses" if score >= self.gray_threshold else "misses"] += 1
+        return None
+
+    def insert(self, embedding: np.ndarray, value: Any):
+        """Store a value under its embedding"""
+        row = self._normalize(embedding)[np.newaxis, :]
+        if self._embeddings is None or not self._values:
+            self._embeddings = row
+        else:
+            self._embeddings = np.vstack([self._embeddings, row])
+        self._created.append(time.monotonic())
+        self._values.append(value)
+
+        overflow = len(self._values) - self.max_entries
+        if overflow > 0:
+            self._drop_oldest(overflow)
+
+    async def alookup(self, key: str, embedding: np.ndarray) -> Optional[Any]:
+        """Async counterpart of lookup, matching RedisSemanticCache (the key text is unused)"""
+        return self.lookup(embedding)
+    
+    async def ainsert(self, key: str, embedding: np.ndarray, value: Any):
+        """Async counterpart of insert, matching RedisSemanticCache (the key text is unused)"""
+        self.insert(embedding, value)
+    
+    async def aclose(self):
+        """Nothing to release; present for parity with RedisSemanticCache"""
+    
+    def _evict_expired(self):
+        """Drop entries older than the TTL (entries are kept in insertion order)"""
+        cutoff = time.monotonic() - self.ttl
+        expired = 0
+        while expired < len(self._created) and self._created[expired] < cutoff:
+            expired += 1
+        if expired:
+            self._drop_oldest(expired)
+
+    def _drop_oldest(self, count: int):
+        self._embeddings = self._embeddings[count:]
+        del self._created[:count]
+        del self._values[:count]
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class RedisSemanticCache:
+    def __init__(self, redis_url: str, embedding_model: str, name: str = "hilde_analysis",
+                 threshold: float = 0.92, ttl: int = 86400, max_connections: int = 50):
+        """
+        Connect to (or create) a RedisVL semantic cache index shared by all workers
+
+        Args:
+            redis_url: Redis Stack connection URL
+            embedding_model: OpenAI embedding model whose vectors are stored (sets index dimensions)
+            name: Index name and key prefix
+            threshold: Cosine similarity at or above which a stored result is returned
+            ttl: Seconds before an entry expires; hits refresh it
+            max_connections: Size of the Redis connection pool
+        """
+        # Imported here so redisvl is only needed when a Redis cache is configured
+        from redisvl.extensions.cache.llm import SemanticCache as RedisVLSemanticCache
+        from redisvl.utils.vectorize import OpenAITextVectorizer
+
+        self.threshold = threshold
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+        # Vectors are always computed by the caller; the vectorizer only fixes the schema
+        self._cache = RedisVLSemanticCache(
+            name=name,
+            redis_url=redis_url,
+            connection_kwargs={"max_connections": max_connections},
+            distance_threshold=1.0 - threshold,
+            ttl=ttl,
+            vectorizer=OpenAITextVectorizer(model=embedding_model),
+        )
+
+    async def alookup(self, key: str, embedding: np.ndarray) -> Optional[str]:
+        """Return the stored value for the most similar embedding, if similar enough"""
+        hits = await self._cache.acheck(vector=self._as_list(embedding), num_results=1,
+                                        return_fields=["response"])
+        if hits:
+            self.stats["hits"] += 1
+            return hits[0]["response"]
+        self.stats["misses"] += 1
+        return None
+
+    async def ainsert(self, key: str, embedding: np.ndarray, value: str):
+        """Store a serialized value under its key text and embedding"""
+        await self._cache.astore(prompt=key, response=value, vector=self._as_list(embedding))
+
+    async def aclose(self):
+        await self._cache.adisconnect()
+
+    @staticmethod
+    def _as_list(embedding: np.ndarray) -> List[float]:
+        return np.asarray(embedding, dtype=np.float32).tolist()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the ConstraintDebugger caches
+The memo, on-disk cache and incremental snapshot must never change what is reported
+"""
+
+import os
+import pickle
+from typing import List
+
+from constraint_debugger import ConstraintDebugger, ConstraintViolation
+
+PREFIX = '''import sqlite3
+
+counter = 0
+
+def read_name():
+    name = input("Name: ")
+    return name
+
+def lookup(cursor, user_id):
+    cursor.execute("SELECT * FROM users WHERE id = " + str(user_id))
+'''
+
+SUFFIX = '''
+api_key = "sk-9fA2kQ7xL0pZ3vB8wR5t"
+
+async def fetch(cursor):
+    cursor.execute("DELETE FROM sessions WHERE id = %s" % 1)
+
+def clean(value):
+    return value.strip()
+
+cleaned = clean(name.strip())
+'''
+
+def _fresh(code: str, **kwargs) -> List[ConstraintViolation]:
+    """Violations from a debugger with no memo, cache or snapshot to reuse"""
+    return sorted(ConstraintDebugger(**kwargs).analyze_code(code))
+
+def test_cache_and_snapshot_match_fresh_analysis(tmp_path):
+    """Memoized, disk-cached and incrementally analyzed results equal a from-scratch analysis"""
+    rules = ConstraintDebugger.RULES
+    for code in (PREFIX, PREFIX + SUFFIX):
+        expected = _fresh(code, enabled_rules=rules)
+        assert expected
+
+        debugger = ConstraintDebugger(enabled_rules=rules, cache_dir=str(tmp_path))
+        assert sorted(debugger.analyze_code(code)) == expected
+        # Memo hit
+        assert sorted(debugger.analyze_code(code)) == expected
+        # Disk hit from another instance
+        assert sorted(ConstraintDebugger(enabled_rules=rules, cache_dir=str(tmp_path)).analyze_code(code)) == expected
+
+    # Snapshot: only the appended statements are parsed
+    debugger = ConstraintDebugger(enabled_rules=rules)
+    debugger.analyze_code(PREFIX)
+    assert sorted(debugger.analyze_code(PREFIX + SUFFIX)) == _fresh(PREFIX + SUFFIX, enabled_rules=rules)
+
+def test_snapshot_skips_reparsing_prefix(monkeypatch):
+    """Appended code is analyzed on its own, and can still clear a prefix input violation"""
+    debugger = ConstraintDebugger()
+    assert any(v.rule == "sanitize_inputs" for v in debugger.analyze_code(PREFIX))
+
+    def full_parse(code):
+        raise AssertionError("prefix was re-parsed")
+    monkeypatch.setattr(debugger, "_analyze_python_code", full_parse)
+    violations = debugger.analyze_code(PREFIX + SUFFIX)
+    assert not any(v.rule == "sanitize_inputs" for v in violations)
+    assert sorted(violations) == _fresh(PREFIX + SUFFIX)
+
+def test_snapshot_not_used_for_indented_suffix():
+    """An indented continuation could change the last block, so it gets a full analysis"""
+    debugger = ConstraintDebugger()
+    debugger.analyze_code(PREFIX)
+    code = PREFIX + "    cursor.commit()\n"
+    assert not debugger._extends(debugger._snapshot, code)
+    assert sorted(debugger.analyze_code(code)) == _fresh(code)
+
+def test_memo_and_disk_cache_invalidated_by_config(tmp_path):
+    """Changing the rules or the max function length never returns stale results"""
+    code = "def f():\n    a = 1\n    b = 2\n    return a + b\n"
+    debugger = ConstraintDebugger(cache_dir=str(tmp_path))
+    assert debugger.analyze_code(code) == []
+
+    debugger.max_function_length = 3
+    assert [v.rule for v in debugger.analyze_code(code)] == ["max_function_length"]
+
+    debugger.enabled_rules = frozenset({"no_global_vars"})
+    assert debugger.analyze_code(code) == []
+
+    # Each configuration has its own pickle, and each holds that configuration's result
+    paths = sorted(tmp_path.glob("*.pkl"))
+    assert len(paths) == 3
+    results = sorted(len(pickle.loads(path.read_bytes())) for path in paths)
+    assert results == [0, 0, 1]
+
+def test_constraints_file_change_invalidates_memo(tmp_path):
+    """Rules re-read from a changed constraints file apply to a memoized source"""
+    constraints = tmp_path / "constraints.json"
+    constraints.write_text('{"constraints": {"no_global_vars": {"enabled": false}}}')
+    debugger = ConstraintDebugger(constraints_file=str(constraints))
+    assert debugger.analyze_code("x = 1\n") == []
+
+    constraints.write_text('{"constraints": {"no_global_vars": {"enabled": true}}}')
+    stat = constraints.stat()
+    os.utime(constraints, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert [v.rule for v in debugger.analyze_code("x = 1\n")] == ["no_global_vars"]
+
+def test_secret_entropy_threshold():
+    """Low-entropy keyed strings are treated as identifiers; passwords are always flagged"""
+    debugger = ConstraintDebugger(enabled_rules=["no_hardcoded_secrets"])
+    code = '''token_type = "bearer"
+secret_name = "database"
+api_key = "sk-9fA2kQ7xL0pZ3vB8wR5t"
+password = "hunter2"
+'''
+    assert [v.line for v in debugger.analyze_code(code)] == [3, 4]
+    assert ConstraintDebugger._shannon_entropy("bearer") < ConstraintDebugger.SECRET_MIN_ENTROPY
+    assert ConstraintDebugger._shannon_entropy("sk-9fA2kQ7xL0pZ3vB8wR5t") >= ConstraintDebugger.SECRET_MIN_ENTROPY
+
+def test_line_mapping():
+    """Prefilter hits map to the right line, snippet and column, skipping comments"""
+    debugger = ConstraintDebugger(enabled_rules=["disallow_raw_sql"])
+    code = ('# SELECT * FROM users WHERE id = " + x\n'
+            'greeting = "héllo wörld"\n'
+            '\n'
+            'query = "SELECT name FROM users WHERE id = " + user_id\n'
+            'other = "DELETE FROM t WHERE id = %s" % 2')
+    violations = debugger.analyze_code(code)
+    assert [(v.line, v.column) for v in violations] == [(4, 9), (5, 9)]
+    assert violations[0].code_snippet == 'query = "SELECT name FROM users WHERE id = " + user_id'
+    # Last line has no trailing newline
+    assert violations[1].code_snippet == 'other = "DELETE FROM t WHERE id = %s" % 2'
+    assert debugger._line(6) == "" and debugger._line(0) == ""
@@ -6,18 +6,21 @@ Provides code completion with top-k token probabilities using Qwen2.5-Coder-32B
 
 import os
 import json
+import math
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-import torch
 from vllm import LLM, SamplingParams
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="HILDE Completion Service", version="1.0.0")
+app = FastAPI(title="HILDE Completion Service", version="1.0.0", default_response_class=ORJSONResponse)
 
 class CompletionRequest(BaseModel):
     prompt: str
@@ -36,88 +39,126 @@ class CompletionResponse(BaseModel):
     tokens: List[TokenInfo]
     top_k_tokens: List[List[TokenInfo]]
 
+# Responses carry top_k rows per generated token, so they are built as plain dicts
+# shaped like CompletionResponse and serialized by orjson without pydantic validation
+TokenRow = Dict[str, Any]
+
 class HILDECompletionEngine:
     def __init__(self):
-        self.model = None
+        self._model = None
+        self._model_lock = threading.Lock()
+        # The offline LLM engine is not thread-safe; generate calls from worker threads take turns
+        self._generate_lock = threading.Lock()
         self.model_name = "Qwen/Qwen2.5-Coder-32B-Instruct"
-        self.initialize_model()
+    
+    @property
+    def model(self) -> LLM:
+        """The vLLM engine, loaded on first use so importing the service stays cheap"""
+        if self._model is None:
+            with self._model_lock:
+                # Concurrent first requests wait for a single load
+                if self._model is None:
+                    self.initialize_model()
+        return self._model
+    
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
     
     def initialize_model(self):
         """Initialize the completion model with vLLM"""
         try:
             logger.info(f"Loading model: {self.model_name}")
-            self.model = LLM(
+            self._model = LLM(
                 model=self.model_name,
                 trust_remote_code=True,
                 gpu_memory_utilization=0.9,
-                max_model_len=8192
+                max_model_len=8192,
+                # Reuse KV blocks for prompts that share a prefix (suffix candidates, edits to the same file)
+                enable_prefix_caching=True
             )
             logger.info("Model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             raise
     
-    def get_completion_with_alternatives(self, request: CompletionRequest) -> CompletionResponse:
+    def get_completion_with_alternatives(self, request: CompletionRequest) -> Dict[str, Any]:
         """Generate completion with top-k token alternatives at each step"""
         try:
-            # Generate base completion
+            # vLLM returns the top-k log-probabilities it already computed while sampling
             sampling_params = SamplingParams(
                 temperature=request.temperature,
                 max_tokens=request.max_tokens,
                 top_k=request.top_k,
+                logprobs=request.top_k,
                 stop=request.stop_tokens or []
             )
             
-            outputs = self.model.generate([request.prompt], sampling_params)
-            completion = outputs[0].outputs[0].text
+            model = self.model
+            with self._generate_lock:
+                outputs = model.generate([request.prompt], sampling_params)
+            output = outputs[0].outputs[0]
+            tokens, top_k_tokens = self._collect_token_logprobs(output.token_ids, output.logprobs or [])
             
-            # Get token-level alternatives (this is a simplified version)
-            # In a real implementation, we'd need to access the model's internal token probabilities
-            tokens = self._extract_tokens_with_alternatives(request.prompt, completion)
-            
-            return CompletionResponse(
-                completion=completion,
-                tokens=tokens,
-                top_k_tokens=self._generate_top_k_tokens(request.prompt, completion, request.top_k)
-            )
+            return {
+                "completion": output.text,
+                "tokens": tokens,
+                "top_k_tokens": top_k_tokens
+            }
             
         except Exception as e:
             logger.error(f"Completion generation failed: {e}")
             raise HTTPException(status_code=500, detail=str(e))
     
-    def _extract_tokens_with_alternatives(self, prompt: str, completion: str) -> List[TokenInfo]:
-        """Extract tokens from completion with basic probability estimates"""
-        # This is a simplified implementation
-        # In practice, we'd need to access the model's token probabilities during generation
+    def generate_completions(self, prompts: List[str], max_tokens: int,
+                             temperatures: List[float]) -> List[str]:
+        """Sample one completion per (prompt, temperature) pair in a single batched engine call"""
+        # vLLM schedules the whole list together, so shared prompts are prefilled once
+        sampling_params = [SamplingParams(temperature=temperature, max_tokens=max_tokens)
+                           for temperature in temperatures]
+        model = self.model
+        with self._generate_lock:
+            outputs = model.generate(prompts, sampling_params)
+        return [output.outputs[0].text for output in outputs]
+    
+    def _collect_token_logprobs(self, token_ids: List[int], logprobs: List[Dict[int, Any]]
+                                ) -> Tuple[List[TokenRow], List[List[TokenRow]]]:
+        """Turn vLLM's per-position {token_id: logprob} maps into chosen tokens and ranked alternatives"""
+        # Rank each position's alternatives, most likely first
+        ranked = [
+            sorted(((token_id, self._logprob_value(entry)) for token_id, entry in position.items()),
+                   key=lambda item: item[1], reverse=True)
+            for position in logprobs
+        ]
+        
+        # Decode every token id that appears in the output in one tokenizer call
+        texts: Dict[int, str] = {}
+        for position in logprobs:
+            for token_id, entry in position.items():
+                decoded = getattr(entry, "decoded_token", None)
+                if decoded is not None:
+                    texts[token_id] = decoded
+        missing = [token_id for token_id in set(token_ids).union(*logprobs) if token_id not in texts]
+        if missing:
+            tokenizer = self.model.get_tokenizer()
+            # Decoded one id at a time, so byte-level BPE pieces come back as text ("Ġreturn" -> " return")
+            texts.update(zip(missing, tokenizer.batch_decode([[token_id] for token_id in missing])))
+        
         tokens = []
-        for i, char in enumerate(completion):
-            # Simplified probability calculation
-            prob = 0.8 if i < len(completion) // 2 else 0.6
-            tokens.append(TokenInfo(
-                token=char,
-                probability=prob,
-                log_prob=torch.log(torch.tensor(prob)).item()
-            ))
-        return tokens
+        top_k_tokens = []
+        for token_id, position, alternatives in zip(token_ids, logprobs, ranked):
+            log_prob = self._logprob_value(position[token_id]) if token_id in position else float("-inf")
+            tokens.append({"token": texts[token_id], "probability": math.exp(log_prob), "log_prob": log_prob})
+            top_k_tokens.append([
+                {"token": texts[alt_id], "probability": math.exp(alt_log_prob), "log_prob": alt_log_prob}
+                for alt_id, alt_log_prob in alternatives
+            ])
+        return tokens, top_k_tokens
     
-    def _generate_top_k_tokens(self, prompt: str, completion: str, top_k: int) -> List[List[TokenInfo]]:
-        """Generate top-k token alternatives for each position"""
-        # This is a simplified implementation
-        # In practice, we'd need to access the model's token probabilities during generation
-        alternatives = []
-        for i in range(len(completion)):
-            pos_alternatives = []
-            for j in range(top_k):
-                # Generate alternative tokens (simplified)
-                alt_token = chr(ord('a') + (i + j) % 26) if completion[i].isalpha() else completion[i]
-                prob = 0.1 + (0.8 / (j + 1))  # Decreasing probability
-                pos_alternatives.append(TokenInfo(
-                    token=alt_token,
-                    probability=prob,
-                    log_prob=torch.log(torch.tensor(prob)).item()
-                ))
-            alternatives.append(pos_alternatives)
-        return alternatives
+    @staticmethod
+    def _logprob_value(entry: Any) -> float:
+        # Newer vLLM wraps each value in a Logprob object; older versions return plain floats
+        return float(getattr(entry, "logprob", entry))
 
 # Initialize the completion engine
 completion_engine = HILDECompletionEngine()
@@ -125,12 +166,22 @@ completion_engine = HILDECompletionEngine()
 @app.post("/completion", response_model=CompletionResponse)
 async def generate_completion(request: CompletionRequest):
     """Generate code completion with token alternatives"""
-    return completion_engine.get_completion_with_alternatives(request)
+    # Off the event loop, so a model load or a long generation never stalls /health or other routes
+    result = await asyncio.to_thread(completion_engine.get_completion_with_alternatives, request)
+    # Returned directly so FastAPI skips re-validating every row against response_model
+    return ORJSONResponse(result)
+
+@app.post("/warmup")
+async def warmup():
+    """Load the model ahead of the first completion; returns once it is ready"""
+    await asyncio.to_thread(lambda: completion_engine.model)
+    return {"status": "ready", "model": completion_engine.model_name}
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "model": completion_engine.model_name}
+    return {"status": "healthy", "model": completion_engine.model_name,
+            "model_loaded": completion_engine.model_loaded}
 
 if __name__ == "__main__":
     import uvicorn
@@ -5,23 +5,35 @@ Orchestrates communication between completion and analysis services
 """
 
 import os
-import json
 import logging
 import asyncio
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-import httpx
+import aiohttp
+import numpy as np
+import orjson
 from loguru import logger
 
 # Configure logging
 logger.add("logs/hilde_gateway.log", rotation="1 day", retention="7 days")
 
-app = FastAPI(title="HILDE API Gateway", version="1.0.0")
+app = FastAPI(title="HILDE API Gateway", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Service URLs
 COMPLETION_SERVICE_URL = os.getenv("COMPLETION_SERVICE_URL", "http://completion-llm:8000")
 ANALYSIS_SERVICE_URL = os.getenv("ANALYSIS_SERVICE_URL", "http://analysis-llm:8000")
+# Connection pool size shared by both upstream services, and the cap per service
+MAX_CONNECTIONS = 200
+MAX_CONNECTIONS_PER_HOST = 100
+# Seconds an idle upstream connection is kept open for reuse
+KEEPALIVE_TIMEOUT = 30.0
+# Concurrent single-alternative requests when the batch endpoint is unavailable
+FALLBACK_CONCURRENCY = 32
+# Analyses remembered per (original, alternative, language) token swap; the same swaps recur across completions
+ANALYSIS_CACHE_SIZE = int(os.getenv("HILDE_ANALYSIS_CACHE_SIZE", "50000"))
 
 class HILDECompletionRequest(BaseModel):
     prompt: str
@@ -55,8 +67,28 @@ class HILDECompletionResponse(BaseModel):
 
 class HILDEGateway:
     def __init__(self):
-        self.completion_client = httpx.AsyncClient(timeout=30.0)
-        self.analysis_client = httpx.AsyncClient(timeout=30.0)
+        # Created on startup, inside the event loop it will serve
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._analysis_cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+    
+    async def start(self):
+        """Open the pooled session used for every upstream request"""
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                                           keepalive_timeout=KEEPALIVE_TIMEOUT),
+            timeout=aiohttp.ClientTimeout(total=30.0)
+        )
+    
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+    
+    async def _post_json(self, url: str, payload: Any) -> Any:
+        """POST a JSON payload and return the decoded JSON response, raising on error statuses"""
+        async with self.session.post(url, data=orjson.dumps(payload),
+                                     headers={"Content-Type": "application/json"}) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
     
     async def generate_completion_with_analysis(self, request: HILDECompletionRequest) -> HILDECompletionResponse:
         """Generate completion with semantic analysis of alternatives"""
@@ -64,15 +96,19 @@ class HILDEGateway:
             # Step 1: Get base completion with token alternatives
             completion_response = await self._get_completion(request)
             
-            # Step 2: Analyze token alternatives if enabled
-            if request.enable_analysis:
-                await self._analyze_alternatives(completion_response)
-            
-            # Step 3: Check constraints on the generated code
-            constraint_violations = await self._check_constraints(
+            # Steps 2 and 3 both only need the completion, so they run concurrently:
+            # analyze token alternatives (if enabled) and check constraints on the generated code
+            constraint_task = self._check_constraints(
                 completion_response["completion"], 
                 "python"  # Default to python, could be made configurable
             )
+            if request.enable_analysis:
+                # Both helpers handle their own failures, so neither can cancel the other
+                _, constraint_violations = await asyncio.gather(
+                    self._analyze_alternatives(completion_response), constraint_task
+                )
+            else:
+                constraint_violations = await constraint_task
             
             # Step 4: Calculate corrected entropy and identify highlights
             corrected_entropy = self._calculate_corrected_entropy(completion_response)
@@ -91,15 +127,73 @@ class HILDEGateway:
             logger.error(f"Gateway error: {e}")
             raise HTTPException(status_code=500, detail=str(e))
     
+    async def stream_completion_with_analysis(self, request: HILDECompletionRequest) -> AsyncIterator[bytes]:
+        """
+        Generate a completion, then return an iterator of NDJSON lines for its analysis
+        
+        The completion is fetched before returning, so a completion service failure raises here
+        as a plain error response instead of breaking the stream once it has started.
+        """
+        completion_response = await self._get_completion(request)
+        return self.stream_analysis(request, completion_response)
+    
+    async def stream_analysis(self, request: HILDECompletionRequest,
+                              completion_response: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """
+        Yield NDJSON lines for a completion as its analysis progresses
+        
+        Lines, in order: the completion with its tokens; one "analysis" line per position with
+        alternatives, as each finishes; the constraint violations; and a final "summary" line
+        with corrected entropy scores and highlighted positions.
+        """
+        completion = completion_response["completion"]
+        yield self._ndjson({"type": "completion", **completion_response})
+        
+        # Constraints only need the completion, so they are checked while alternatives are analyzed
+        constraint_task = asyncio.create_task(self._check_constraints(completion, "python"))
+        try:
+            if request.enable_analysis:
+                positions = [
+                    self._analyze_position(completion, i, alternatives)
+                    for i, alternatives in enumerate(completion_response["top_k_tokens"])
+                    if len(alternatives) > 1
+                ]
+                for finished in asyncio.as_completed(positions):
+                    try:
+                        position, analyses = await finished
+                    except Exception as e:
+                        # Continue without this position's analysis rather than failing the stream
+                        logger.error(f"Analysis error: {e}")
+                        continue
+                    yield self._ndjson({"type": "analysis", "position": position, "analyses": analyses})
+            
+            constraint_violations = await constraint_task
+        finally:
+            # The client may disconnect mid-stream
+            constraint_task.cancel()
+        yield self._ndjson({
+            "type": "constraints",
+            "constraint_violations": [violation.model_dump() for violation in constraint_violations]
+        })
+        
+        corrected_entropy = self._calculate_corrected_entropy(completion_response)
+        yield self._ndjson({
+            "type": "summary",
+            "corrected_entropy_scores": corrected_entropy,
+            "highlighted_positions": self._identify_highlights(corrected_entropy)
+        })
+    
+    @staticmethod
+    def _ndjson(event: Dict[str, Any]) -> bytes:
+        return orjson.dumps(event) + b"\n"
+    
     async def _get_completion(self, request: HILDECompletionRequest) -> Dict[str, Any]:
         """Get completion from completion service"""
         try:
-            response = await self.completion_client.post(
+            return await self._post_json(
                 f"{COMPLETION_SERVICE_URL}/completion",
-                json=request.dict(exclude={"enable_analysis"})
+                request.model_dump(exclude={"enable_analysis"})
             )
-            response.raise_for_status()
-            return response.json()
         except Exception as e:
             logger.error(f"Completion service error: {e}")
             raise HTTPException(status_code=500, detail=f"Completion service error: {e}")
@@ -107,16 +201,18 @@ class HILDEGateway:
     async def _analyze_alternatives(self, completion_response: Dict[str, Any]):
         """Analyze token alternatives using analysis service"""
         try:
-            # Analyze each position with alternatives
+            # One analysis request per alternative, skipping the first (top) token at each position
+            completion = completion_response["completion"]
+            targets = []
+            pairs = []
             for i, alternatives in enumerate(completion_response["top_k_tokens"]):
-                for j, alt in enumerate(alternatives[1:], 1):  # Skip the first (top) token
-                    analysis = await self._analyze_single_alternative(
-                        completion_response["completion"],
-                        alternatives[0]["token"],  # Original token
-                        alt["token"],  # Alternative token
-                        f"Position {i} in completion"
-                    )
-                    alt["analysis"] = analysis
+                targets.extend(alternatives[1:])
+                pairs.extend(self._alternative_pairs(completion, i, alternatives))
+            if not pairs:
+                return
+            
+            for alt, analysis in zip(targets, await self._analyze_pairs(pairs)):
+                alt["analysis"] = analysis
             
             logger.info("Completed analysis of token alternatives")
             
@@ -124,21 +220,74 @@ class HILDEGateway:
             logger.error(f"Analysis error: {e}")
             # Continue without analysis rather than failing completely
     
-    async def _analyze_single_alternative(self, completion: str, original: str, alternative: str, context: str) -> Dict[str, Any]:
+    async def _analyze_position(self, completion: str, position: int,
+                                alternatives: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """Analyze the alternatives at one position, attaching and returning their analyses"""
+        analyses = await self._analyze_pairs(self._alternative_pairs(completion, position, alternatives))
+        for alt, analysis in zip(alternatives[1:], analyses):
+            alt["analysis"] = analysis
+        return position, analyses
+    
+    @staticmethod
+    def _alternative_pairs(completion: str, position: int, alternatives: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analysis requests comparing each alternative at a position with its top token"""
+        return [
+            {
+                "base_completion": completion,
+                "original_token": alternatives[0]["token"],
+                "alternative_token": alt["token"],
+                "context": f"Position {position} in completion",
+                "language": "python"
+            }
+            for alt in alternatives[1:]
+        ]
+    
+    async def _analyze_pairs(self, pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze token swaps, answering repeats from the local cache and sending each new swap once"""
+        keys = [(pair["original_token"], pair["alternative_token"], pair["language"]) for pair in pairs]
+        misses: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for key, pair in zip(keys, pairs):
+            if key in self._analysis_cache:
+                self._analysis_cache.move_to_end(key)
+            else:
+                misses.setdefault(key, pair)
+        
+        if misses:
+            for key, analysis in zip(misses, await self._request_analyses(list(misses.values()))):
+                # Leave failures uncached so the swap is retried next time
+                if analysis.get("explanation_summary") != "Analysis error":
+                    self._analysis_cache[key] = analysis
+                    if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                        self._analysis_cache.popitem(last=False)
+                misses[key] = analysis
+        
+        return [misses[key] if key in misses else self._analysis_cache[key] for key in keys]
+    
+    async def _request_analyses(self, pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze through the batch endpoint, falling back to concurrent single requests"""
+        try:
+            return await self._analyze_alternatives_batch(pairs)
+        except Exception as e:
+            logger.warning(f"Batch analysis failed, analyzing alternatives individually: {e}")
+            semaphore = asyncio.Semaphore(FALLBACK_CONCURRENCY)
+            
+            async def analyze(pair: Dict[str, Any]) -> Dict[str, Any]:
+                async with semaphore:
+                    return await self._analyze_single_alternative(pair)
+            
+            return await asyncio.gather(*(analyze(pair) for pair in pairs))
+    
+    async def _analyze_alternatives_batch(self, pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze all token alternatives in a single request to the batch endpoint"""
+        analyses = await self._post_json(f"{ANALYSIS_SERVICE_URL}/analysis/batch", pairs)
+        if len(analyses) != len(pairs):
+            raise ValueError(f"Expected {len(pairs)} analyses, got {len(analyses)}")
+        return analyses
+    
+    async def _analyze_single_alternative(self, pair: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze a single token alternative"""
         try:
-            response = await self.analysis_client.post(
-                f"{ANALYSIS_SERVICE_URL}/analysis",
-                json={
-                    "base_completion": completion,
-                    "original_token": original,
-                    "alternative_token": alternative,
-                    "context": context,
-                    "language": "python"
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+            return await self._post_json(f"{ANALYSIS_SERVICE_URL}/analysis", pair)
         except Exception as e:
             logger.warning(f"Single analysis failed: {e}")
             return {
@@ -150,48 +299,44 @@ class HILDEGateway:
     
     def _calculate_corrected_entropy(self, completion_response: Dict[str, Any]) -> List[float]:
         """Calculate corrected entropy using importance scores"""
-        corrected_entropy = []
+        positions = completion_response["top_k_tokens"]
+        if not positions:
+            return []
         
-        for i, alternatives in enumerate(completion_response["top_k_tokens"]):
-            if len(alternatives) < 2:
-                corrected_entropy.append(0.0)
-                continue
-            
-            # Calculate entropy considering importance scores
-            probs = []
-            for alt in alternatives:
-                importance = alt.get("analysis", {}).get("importance_score", 0.5)
-                # Adjust probability based on importance
-                adjusted_prob = alt["probability"] * importance
-                probs.append(adjusted_prob)
-            
-            # Normalize probabilities
-            total = sum(probs)
-            if total > 0:
-                probs = [p / total for p in probs]
-            
-            # Calculate entropy
-            entropy = -sum(p * (p.bit_length() if p > 0 else 0) for p in probs)
-            corrected_entropy.append(entropy)
+        # One row per position, zero-padded to the widest; padding adds nothing to the entropy
+        lengths = np.fromiter((len(alternatives) for alternatives in positions), dtype=np.int64, count=len(positions))
+        probs = np.zeros((len(positions), max(int(lengths.max()), 1)))
+        for i, alternatives in enumerate(positions):
+            # Adjust each probability by the importance of choosing that alternative
+            probs[i, :len(alternatives)] = [
+                alt["probability"] * (alt.get("analysis") or {}).get("importance_score", 0.5)
+                for alt in alternatives
+            ]
+        
+        # Normalize each row, leaving all-zero rows as they are
+        totals = probs.sum(axis=1, keepdims=True)
+        np.divide(probs, totals, out=probs, where=totals > 0)
         
-        return corrected_entropy
+        # Shannon entropy in bits, one row per position
+        log_probs = np.log2(probs, out=np.zeros_like(probs), where=probs > 0)
+        entropy = 0.0 - (probs * log_probs).sum(axis=1)  # Not -x, which turns zero rows into -0.0
+        entropy[lengths < 2] = 0.0  # A lone token is no decision
+        return entropy.tolist()
     
     def _identify_highlights(self, corrected_entropy: List[float], threshold: float = 0.3) -> List[int]:
         """Identify positions that should be highlighted"""
-        return [i for i, entropy in enumerate(corrected_entropy) if entropy > threshold]
+        return np.flatnonzero(np.asarray(corrected_entropy) > threshold).tolist()
     
     async def _check_constraints(self, code: str, language: str) -> List[ConstraintViolation]:
         """Check code for constraint violations"""
         try:
-            response = await self.analysis_client.post(
+            constraint_data = await self._post_json(
                 f"{ANALYSIS_SERVICE_URL}/constraints",
-                json={
+                {
                     "code": code,
                     "language": language
                 }
             )
-            response.raise_for_status()
-            constraint_data = response.json()
             
             # Convert to ConstraintViolation objects
             violations = []
@@ -217,7 +362,15 @@ gateway = HILDEGateway()
 @app.post("/hilde/completion", response_model=HILDECompletionResponse)
 async def hilde_completion(request: HILDECompletionRequest):
     """Main HILDE completion endpoint with semantic analysis"""
-    return await gateway.generate_completion_with_analysis(request)
+    # Returning a response directly skips FastAPI re-validating the model
+    result = await gateway.generate_completion_with_analysis(request)
+    return ORJSONResponse(result.model_dump())
+
+@app.post("/hilde/completion/stream")
+async def hilde_completion_stream(request: HILDECompletionRequest):
+    """HILDE completion streamed as NDJSON, with analyses sent as each position finishes"""
+    lines = await gateway.stream_completion_with_analysis(request)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @app.get("/health")
 async def health_check():
@@ -228,12 +381,18 @@ async def health_check():
         "analysis_service": ANALYSIS_SERVICE_URL
     }
 
+@app.on_event("startup")
+async def startup_event():
+    """Open the upstream connection pool"""
+    await gateway.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    await gateway.completion_client.aclose()
-    await gateway.analysis_client.aclose()
+    await gateway.close()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop and httptools (from uvicorn[standard]) cut per-socket overhead on the fan-out path;
+    # naming them fails fast if they are missing instead of silently using the slower defaults
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
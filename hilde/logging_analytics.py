@@ -4,14 +4,22 @@ HILDE Logging and Analytics Service
 Tracks user interactions and provides insights
 """
 
-import json
+import os
 import time
+import queue
+import asyncio
 import sqlite3
+import tempfile
+import threading
+import logging
+import orjson
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 @dataclass
 class UserInteraction:
     timestamp: datetime
@@ -34,11 +42,63 @@ class SecurityMetrics:
     security_scan_time_ms: int
     language: str
 
+# Process umask, read once at import (os.umask can only be read by setting it); exported reports get
+# the mode a plainly created file would, so bind-mounted log directories stay readable from the host
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Bucket an entropy score column (NULL scores count as high, as in the original reports)
+ENTROPY_LEVEL_SQL = "CASE WHEN {0} < 0.3 THEN 'low' WHEN {0} < 0.7 THEN 'medium' ELSE 'high' END"
+
+INSERT_INTERACTION_SQL = '''
+    INSERT INTO user_interactions 
+    (timestamp, action_type, token_position, original_token, alternative_token,
+     decision_time_ms, entropy_score, importance_score, category, language, file_extension)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_SECURITY_SQL = '''
+    INSERT INTO security_metrics 
+    (timestamp, vulnerabilities_found, vulnerabilities_fixed, security_scan_time_ms, language)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
 class HILDELoggingService:
+    # Rows written per transaction, and how long the writer waits to fill a batch
+    BATCH_SIZE = 500
+    BATCH_WAIT_SECONDS = 0.1
+    # Reader connections map up to this many bytes of the database and cache this many KiB of pages
+    READ_MMAP_BYTES = 256 * 1024 * 1024
+    READ_CACHE_KIB = 64 * 1024
+    
     def __init__(self, db_path: str = "logs/hilde_analytics.db"):
         self.db_path = db_path
         self.ensure_db_directory()
+        
+        # One connection for the service's lifetime, shared by callers and the writer thread
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        self._conn_lock = threading.Lock()
         self.init_database()
+        
+        # Insights queries use a read-only connection per thread; under WAL they never wait on the writer
+        self._reader = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        
+        # Logged rows are buffered and inserted in batches, one transaction (and fsync) per batch
+        self._pending: queue.Queue = queue.Queue()
+        # Set by close(); checked under the lock so no row is queued behind the writer's stop sentinel
+        self._closed = False
+        self._closed_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_batches, name="hilde-analytics-writer", daemon=True)
+        self._writer.start()
+        
+        # Insights are reused until the writer commits another row to their table: {table: (version, insights)}
+        self._versions = {'user_interactions': 0, 'security_metrics': 0}
+        self._insights_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
     
     def ensure_db_directory(self):
         """Ensure the database directory exists"""
@@ -46,9 +106,16 @@ class HILDELoggingService:
     
     def init_database(self):
         """Initialize the SQLite database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self._conn_lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN')
+            self._create_tables(cursor)
+            self._create_summaries(cursor)
+            cursor.execute('COMMIT')
+    
+    @staticmethod
+    def _create_tables(cursor: sqlite3.Cursor):
+        """Create the raw event tables"""
         # Create user interactions table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_interactions (
@@ -90,21 +157,99 @@ class HILDELoggingService:
                 language TEXT
             )
         ''')
-        
-        conn.commit()
-        conn.close()
     
-    def log_user_interaction(self, interaction: UserInteraction):
-        """Log a user interaction"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def _create_summaries(cursor: sqlite3.Cursor):
+        """Create aggregate tables kept current by insert triggers, so insights never rescan raw events"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'summarize_user_interaction'")
+        if cursor.fetchone():
+            return
         
+        # One row per entropy level
         cursor.execute('''
-            INSERT INTO user_interactions 
-            (timestamp, action_type, token_position, original_token, alternative_token,
-             decision_time_ms, entropy_score, importance_score, category, language, file_extension)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+            CREATE TABLE IF NOT EXISTS user_interaction_summary (
+                entropy_level TEXT PRIMARY KEY,
+                interactions INTEGER NOT NULL,
+                alternatives_offered INTEGER NOT NULL,
+                alternatives_selected INTEGER NOT NULL,
+                decision_time_sum INTEGER NOT NULL,
+                decision_time_count INTEGER NOT NULL
+            )
+        ''')
+        # One row per day
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS security_daily_summary (
+                date TEXT PRIMARY KEY,
+                vulnerabilities_found INTEGER NOT NULL,
+                vulnerabilities_fixed INTEGER NOT NULL,
+                scan_time_sum INTEGER NOT NULL,
+                scan_time_count INTEGER NOT NULL
+            )
+        ''')
+        
+        # Backfill from events logged before the summaries existed
+        cursor.execute(f'''
+            INSERT INTO user_interaction_summary
+            SELECT {ENTROPY_LEVEL_SQL.format('entropy_score')},
+                   COUNT(*),
+                   SUM(action_type = 'alternative_selected'),
+                   SUM(action_type = 'alternative_selected' AND alternative_token IS NOT NULL),
+                   COALESCE(SUM(decision_time_ms), 0),
+                   COUNT(decision_time_ms)
+            FROM user_interactions
+            GROUP BY 1
+        ''')
+        cursor.execute('''
+            INSERT INTO security_daily_summary
+            SELECT DATE(timestamp),
+                   COALESCE(SUM(vulnerabilities_found), 0),
+                   COALESCE(SUM(vulnerabilities_fixed), 0),
+                   COALESCE(SUM(security_scan_time_ms), 0),
+                   COUNT(security_scan_time_ms)
+            FROM security_metrics
+            GROUP BY 1
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TRIGGER summarize_user_interaction AFTER INSERT ON user_interactions
+            BEGIN
+                INSERT INTO user_interaction_summary VALUES (
+                    {ENTROPY_LEVEL_SQL.format('NEW.entropy_score')},
+                    1,
+                    NEW.action_type = 'alternative_selected',
+                    NEW.action_type = 'alternative_selected' AND NEW.alternative_token IS NOT NULL,
+                    COALESCE(NEW.decision_time_ms, 0),
+                    NEW.decision_time_ms IS NOT NULL
+                )
+                ON CONFLICT (entropy_level) DO UPDATE SET
+                    interactions = interactions + excluded.interactions,
+                    alternatives_offered = alternatives_offered + excluded.alternatives_offered,
+                    alternatives_selected = alternatives_selected + excluded.alternatives_selected,
+                    decision_time_sum = decision_time_sum + excluded.decision_time_sum,
+                    decision_time_count = decision_time_count + excluded.decision_time_count;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER summarize_security_metrics AFTER INSERT ON security_metrics
+            BEGIN
+                INSERT INTO security_daily_summary VALUES (
+                    DATE(NEW.timestamp),
+                    COALESCE(NEW.vulnerabilities_found, 0),
+                    COALESCE(NEW.vulnerabilities_fixed, 0),
+                    COALESCE(NEW.security_scan_time_ms, 0),
+                    NEW.security_scan_time_ms IS NOT NULL
+                )
+                ON CONFLICT (date) DO UPDATE SET
+                    vulnerabilities_found = vulnerabilities_found + excluded.vulnerabilities_found,
+                    vulnerabilities_fixed = vulnerabilities_fixed + excluded.vulnerabilities_fixed,
+                    scan_time_sum = scan_time_sum + excluded.scan_time_sum,
+                    scan_time_count = scan_time_count + excluded.scan_time_count;
+            END
+        ''')
+    
+    def log_user_interaction(self, interaction: UserInteraction):
+        """Log a user interaction (written by the background writer; see flush)"""
+        self._enqueue('user_interactions', INSERT_INTERACTION_SQL, (
             interaction.timestamp.isoformat(),
             interaction.action_type,
             interaction.token_position,
@@ -117,75 +262,141 @@ class HILDELoggingService:
             interaction.language,
             interaction.file_extension
         ))
-        
-        conn.commit()
-        conn.close()
     
     def log_security_metrics(self, metrics: SecurityMetrics):
-        """Log security-related metrics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO security_metrics 
-            (timestamp, vulnerabilities_found, vulnerabilities_fixed, security_scan_time_ms, language)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
+        """Log security-related metrics (written by the background writer; see flush)"""
+        self._enqueue('security_metrics', INSERT_SECURITY_SQL, (
             metrics.timestamp.isoformat(),
             metrics.vulnerabilities_found,
             metrics.vulnerabilities_fixed,
             metrics.security_scan_time_ms,
             metrics.language
         ))
-        
-        conn.commit()
-        conn.close()
+    
+    def flush(self):
+        """Block until every row logged so far has been written"""
+        if self._closed:
+            # The writer has stopped; nothing would ever mark new rows done
+            raise RuntimeError("Logging service is closed")
+        self._pending.join()
+    
+    def close(self):
+        """Write any buffered rows, stop the writer and close the database"""
+        with self._closed_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending.put(None)
+        self._writer.join()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._conn_lock:
+            self._conn.close()
+    
+    # Async counterparts for request handlers. Logging itself only queues rows and never blocks;
+    # these run the blocking waits, queries and file writes in a worker thread instead of the event loop
+    
+    async def aflush(self):
+        await asyncio.to_thread(self.flush)
+    
+    async def aclose(self):
+        await asyncio.to_thread(self.close)
+    
+    async def aget_user_behavior_insights(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_user_behavior_insights)
+    
+    async def aget_security_insights(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_security_insights)
+    
+    async def aexport_analytics_report(self, output_path: str = "logs/hilde_analytics_report.json") -> str:
+        return await asyncio.to_thread(self.export_analytics_report, output_path)
+    
+    def _enqueue(self, table: str, sql: str, row: tuple):
+        with self._closed_lock:
+            if self._closed:
+                raise RuntimeError("Logging service is closed")
+            self._pending.put((table, sql, row))
+    
+    def _write_batches(self):
+        """Writer thread: insert up to BATCH_SIZE rows, or whatever arrives within BATCH_WAIT_SECONDS, per transaction"""
+        running = True
+        while running:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.BATCH_WAIT_SECONDS
+            while len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Group rows by statement (None is the close() sentinel)
+            rows_by_sql: Dict[str, List[tuple]] = {}
+            tables = set()
+            for item in batch:
+                if item is None:
+                    running = False
+                else:
+                    table, sql, row = item
+                    tables.add(table)
+                    rows_by_sql.setdefault(sql, []).append(row)
+            try:
+                if rows_by_sql:
+                    self._insert_batch(rows_by_sql)
+                    # Only committed rows invalidate cached insights
+                    for table in tables:
+                        self._versions[table] += 1
+            except sqlite3.Error:
+                # Analytics are best effort; drop the batch rather than stop logging
+                logger.exception("Failed to write analytics batch")
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+    
+    def _insert_batch(self, rows_by_sql: Dict[str, List[tuple]]):
+        with self._conn_lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                for sql, rows in rows_by_sql.items():
+                    cursor.executemany(sql, rows)
+            except sqlite3.Error:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
     
     def get_user_behavior_insights(self) -> Dict[str, Any]:
         """Get insights about user behavior"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self._cached_insights('user_interactions', self._query_user_behavior_insights)
+    
+    @staticmethod
+    def _query_user_behavior_insights(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+        """Read user behavior insights from the per-entropy-level summary (at most three rows)"""
+        cursor.execute('''
+            SELECT entropy_level, interactions, alternatives_offered, alternatives_selected,
+                   decision_time_sum, decision_time_count
+            FROM user_interaction_summary
+        ''')
+        rows = cursor.fetchall()
         
-        # Get total interactions
-        cursor.execute('SELECT COUNT(*) FROM user_interactions')
-        total_interactions = cursor.fetchone()[0]
+        total_interactions = sum(row[1] for row in rows)
         
         # Get alternative selection rate
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_alternatives,
-                SUM(CASE WHEN alternative_token IS NOT NULL THEN 1 ELSE 0 END) as selected_alternatives
-            FROM user_interactions 
-            WHERE action_type = 'alternative_selected'
-        ''')
-        alt_result = cursor.fetchone()
+        alternatives_offered = sum(row[2] for row in rows)
         alternative_selection_rate = 0.0
-        if alt_result and alt_result[0] > 0:
-            alternative_selection_rate = alt_result[1] / alt_result[0]
+        if alternatives_offered > 0:
+            alternative_selection_rate = sum(row[3] for row in rows) / alternatives_offered
         
         # Get average decision time
-        cursor.execute('''
-            SELECT AVG(decision_time_ms) 
-            FROM user_interactions 
-            WHERE decision_time_ms IS NOT NULL
-        ''')
-        avg_decision_time = cursor.fetchone()[0] or 0
+        decision_time_count = sum(row[5] for row in rows)
+        avg_decision_time = sum(row[4] for row in rows) / decision_time_count if decision_time_count else 0
         
         # Get entropy distribution
-        cursor.execute('''
-            SELECT 
-                CASE 
-                    WHEN entropy_score < 0.3 THEN 'low'
-                    WHEN entropy_score < 0.7 THEN 'medium'
-                    ELSE 'high'
-                END as entropy_level,
-                COUNT(*) as count
-            FROM user_interactions 
-            GROUP BY entropy_level
-        ''')
-        entropy_distribution = dict(cursor.fetchall())
-        
-        conn.close()
+        entropy_distribution = {row[0]: row[1] for row in rows}
         
         return {
             'total_interactions': total_interactions,
@@ -196,17 +407,41 @@ class HILDELoggingService:
     
     def get_security_insights(self) -> Dict[str, Any]:
         """Get insights about security improvements"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get vulnerability trends
+        return self._cached_insights('security_metrics', self._query_security_insights)
+    
+    def _cached_insights(self, table: str, query: Callable[[sqlite3.Cursor], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run an insights query, or reuse its last result if nothing was logged to the table since"""
+        # Let rows still buffered for the writer land (and bump the version) first
+        self.flush()
+        version = self._versions[table]
+        cached = self._insights_cache.get(table)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        insights = query(self._reader_connection().cursor())
+        self._insights_cache[table] = (version, insights)
+        return insights
+    
+    def _reader_connection(self) -> sqlite3.Connection:
+        """This thread's read-only connection, opened on first use"""
+        conn = getattr(self._reader, 'conn', None)
+        if conn is None:
+            # check_same_thread is off only so close() can close every thread's connection
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute(f'PRAGMA mmap_size={self.READ_MMAP_BYTES}')
+            conn.execute(f'PRAGMA cache_size=-{self.READ_CACHE_KIB}')
+            conn.execute('PRAGMA query_only=1')
+            self._reader.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+    
+    @staticmethod
+    def _query_security_insights(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+        """Read security insights from the daily summary"""
+        # Get vulnerability trends (newest 30 days, read straight off the date key)
         cursor.execute('''
-            SELECT 
-                DATE(timestamp) as date,
-                SUM(vulnerabilities_found) as found,
-                SUM(vulnerabilities_fixed) as fixed
-            FROM security_metrics 
-            GROUP BY DATE(timestamp)
+            SELECT date, vulnerabilities_found as found, vulnerabilities_fixed as fixed
+            FROM security_daily_summary 
             ORDER BY date DESC
             LIMIT 30
         ''')
@@ -217,13 +452,11 @@ class HILDELoggingService:
             SELECT 
                 SUM(vulnerabilities_found) as total_found,
                 SUM(vulnerabilities_fixed) as total_fixed,
-                AVG(security_scan_time_ms) as avg_scan_time
-            FROM security_metrics
+                CAST(SUM(scan_time_sum) AS REAL) / NULLIF(SUM(scan_time_count), 0) as avg_scan_time
+            FROM security_daily_summary
         ''')
         total_metrics = cursor.fetchone()
         
-        conn.close()
-        
         return {
             'vulnerability_trends': vulnerability_trends,
             'total_vulnerabilities_found': total_metrics[0] or 0,
@@ -233,28 +466,44 @@ class HILDELoggingService:
     
     def export_analytics_report(self, output_path: str = "logs/hilde_analytics_report.json"):
         """Export comprehensive analytics report"""
+        user_insights = self.get_user_behavior_insights()
+        security_insights = self.get_security_insights()
         report = {
             'generated_at': datetime.now().isoformat(),
-            'user_behavior': self.get_user_behavior_insights(),
-            'security_insights': self.get_security_insights(),
-            'recommendations': self._generate_recommendations()
+            'user_behavior': user_insights,
+            'security_insights': security_insights,
+            'recommendations': self._generate_recommendations(user_insights, security_insights)
         }
         
         # Ensure output directory exists
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        output_dir = Path(output_path).parent
+        output_dir.mkdir(parents=True, exist_ok=True)
         
-        with open(output_path, 'w') as f:
-            json.dump(report, f, indent=2)
+        # Write the whole report in one call to a sibling file, then swap it in, so concurrent exports
+        # never interleave and readers see either the previous report or the new one
+        fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+        try:
+            # mkstemp creates the file 0600
+            os.fchmod(fd, 0o666 & ~_UMASK)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+            os.replace(temp_path, output_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
         
         return output_path
     
-    def _generate_recommendations(self) -> List[str]:
+    def _generate_recommendations(self, user_insights: Optional[Dict[str, Any]] = None,
+                                  security_insights: Optional[Dict[str, Any]] = None) -> List[str]:
         """Generate recommendations based on analytics"""
         recommendations = []
         
-        # Get basic insights
-        user_insights = self.get_user_behavior_insights()
-        security_insights = self.get_security_insights()
+        # Get basic insights, unless the caller already has them
+        if user_insights is None:
+            user_insights = self.get_user_behavior_insights()
+        if security_insights is None:
+            security_insights = self.get_security_insights()
         
         # User behavior recommendations
         if user_insights['alternative_selection_rate'] < 0.3:
@@ -300,3 +549,5 @@ if __name__ == "__main__":
     # Display insights
     insights = logging_service.get_user_behavior_insights()
     print(f"User behavior insights: {insights}")
+    
+    logging_service.close()
@@ -4,13 +4,36 @@ HILDE Security Integration Service
 Provides background security scanning using Semgrep and Bandit
 """
 
-import subprocess
-import json
-import tempfile
 import os
-from typing import List, Dict, Any, Optional
+import re
+import asyncio
+import hashlib
+import tempfile
+import orjson
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 
+# Seconds each scanner may run before it is killed
+SCAN_TIMEOUT = 30
+# Semgrep rules: a registry config such as "auto", or a local rules file/directory downloaded ahead
+# of time, which skips the per-run registry fetch
+SEMGREP_CONFIG = os.getenv("HILDE_SEMGREP_CONFIG", "auto")
+# Files queued within this many seconds share one Semgrep run (and one startup and rule parse)
+SEMGREP_BATCH_WINDOW = 0.05
+# Semgrep needs a real path with the right extension; keep it in memory where tmpfs is available
+SCAN_TEMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# File extension Semgrep uses to pick rules for each language
+LANGUAGE_EXTENSIONS = {
+    'python': '.py',
+    'javascript': '.js',
+    'typescript': '.ts',
+    'java': '.java',
+    'cpp': '.cpp',
+    'c': '.c'
+}
+# CWE identifiers as Semgrep writes them in rule metadata ("CWE-327: Use of a Broken ...")
+CWE_RE = re.compile(r'CWE-(\d+)')
+
 @dataclass
 class SecurityIssue:
     rule_id: str
@@ -20,9 +43,21 @@ class SecurityIssue:
     column: int
     file_path: str
     description: str
+    # Weakness class, e.g. "CWE-327", when the scanner reports one
+    cwe: Optional[str] = None
 
 class SecurityIntegrationService:
+    # Scans remembered per (code digest, language); identical snippets are re-scanned often
+    CACHE_SIZE = 4096
+    
     def __init__(self):
+        self._scan_cache: Dict[Tuple[bytes, str], List[SecurityIssue]] = {}
+        # Files waiting for the next batched Semgrep run, with the futures awaiting their findings
+        self._semgrep_pending: List[Tuple[str, asyncio.Future]] = []
+        self._semgrep_args = ['semgrep', 'scan', '--config', SEMGREP_CONFIG, '--json', '--disable-version-check']
+        if os.path.exists(SEMGREP_CONFIG):
+            # Registry configs ("auto") require metrics; local rules need no network at all
+            self._semgrep_args += ['--metrics', 'off']
         self.semgrep_rules = [
             "python.security.audit.weak-cryptographic-algorithm.weak-cryptographic-algorithm",
             "python.security.audit.insecure-hash-algorithm.insecure-hash-algorithm",
@@ -41,113 +76,187 @@ class SecurityIntegrationService:
         Returns:
             List of security issues found
         """
+        # Blocking entry point for synchronous callers; it drives its own event loop, which
+        # cannot be nested inside one that is already running
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.ascan_code_security(code, language))
+        raise RuntimeError("scan_code_security() cannot block a running event loop; "
+                           "await ascan_code_security() instead")
+    
+    async def ascan_code_security(self, code: str, language: str = "python") -> List[SecurityIssue]:
+        """Async counterpart of scan_code_security; Bandit and Semgrep run concurrently"""
+        cache_key = (hashlib.blake2b(code.encode(), digest_size=16).digest(), language.lower())
+        issues = self._scan_cache.pop(cache_key, None)
+        complete = True
+        if issues is None:
+            issues, complete = await self._scan_uncached(code, language)
+        # Only complete scans are remembered, so a scanner failure is retried next time;
+        # most recently used last, and the oldest entry is evicted beyond CACHE_SIZE
+        if complete:
+            self._scan_cache[cache_key] = issues
+            if len(self._scan_cache) > self.CACHE_SIZE:
+                del self._scan_cache[next(iter(self._scan_cache))]
+        return list(issues)
+    
+    async def _scan_uncached(self, code: str, language: str) -> Tuple[List[SecurityIssue], bool]:
+        """Run the scanners; also report whether all of them succeeded"""
+        # Semgrep picks rules by file extension, so it scans a temporary file
+        with tempfile.NamedTemporaryFile(mode='w', suffix=self._get_file_extension(language),
+                                         dir=SCAN_TEMP_DIR, delete=False) as f:
+            f.write(code)
+            temp_file = f.name
+        try:
+            scans = [self._run_semgrep_scan(temp_file)]
+            if language.lower() == "python":
+                # Use Bandit for Python-specific security scanning
+                scans.insert(0, self._run_bandit_scan(code))
+            results = await asyncio.gather(*scans)
+        finally:
+            os.unlink(temp_file)
+        # A weakness reported by both scanners on the same line is kept once; their rule ids and
+        # columns differ, so findings are matched by CWE where the scanner reports one
         issues = []
-        
-        if language.lower() == "python":
-            # Use Bandit for Python-specific security scanning
-            issues.extend(self._run_bandit_scan(code))
-        
-        # Use Semgrep for multi-language security scanning
-        issues.extend(self._run_semgrep_scan(code, language))
-        
-        return issues
+        seen = set()
+        for scan_issues in results:
+            for issue in scan_issues or ():
+                key = (issue.line, issue.cwe) if issue.cwe else (issue.line, issue.column, issue.rule_id)
+                if key not in seen:
+                    seen.add(key)
+                    issues.append(issue)
+        return issues, all(scan_issues is not None for scan_issues in results)
     
-    def _run_bandit_scan(self, code: str) -> List[SecurityIssue]:
-        """Run Bandit security scan on Python code"""
+    @staticmethod
+    async def _run_scanner(*args: str, stdin: Optional[str] = None) -> Optional[bytes]:
+        """Run a scanner command, optionally feeding it stdin, and return its stdout or None if it could not finish"""
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(
+                proc.communicate(stdin.encode() if stdin is not None else None), timeout=SCAN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        # Bandit exits with 1 when it reports issues, which still produces a full report
+        if proc.returncode not in (0, 1):
+            return None
+        return stdout
+    
+    async def _run_bandit_scan(self, code: str) -> Optional[List[SecurityIssue]]:
+        """Run Bandit security scan on Python code (None if the scan failed)"""
         issues = []
         
         try:
-            # Create temporary file for scanning
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code)
-                temp_file = f.name
+            # "-" makes Bandit read the code from stdin, with no file round trip
+            output = await self._run_scanner('bandit', '-f', 'json', '-', stdin=code)
             
-            # Run Bandit scan
-            result = subprocess.run([
-                'bandit', '-f', 'json', '-r', temp_file
-            ], capture_output=True, text=True, timeout=30)
-            
-            # Clean up temporary file
-            os.unlink(temp_file)
+            if output is None:
+                return None
             
-            if result.returncode == 0:
-                # Parse Bandit output
-                try:
-                    bandit_results = json.loads(result.stdout)
-                    for issue in bandit_results.get('results', []):
-                        security_issue = SecurityIssue(
-                            rule_id=issue.get('issue_text', 'Unknown'),
-                            message=issue.get('issue_text', 'Security issue detected'),
-                            severity=issue.get('issue_severity', 'medium'),
-                            line=issue.get('line_number', 0),
-                            column=0,
-                            file_path='<inline>',
-                            description=issue.get('more_info', 'No additional information')
-                        )
-                        issues.append(security_issue)
-                except json.JSONDecodeError:
-                    print("Failed to parse Bandit output")
+            # Parse Bandit output
+            try:
+                bandit_results = orjson.loads(output)
+                for issue in bandit_results.get('results', []):
+                    security_issue = SecurityIssue(
+                        rule_id=issue.get('issue_text', 'Unknown'),
+                        message=issue.get('issue_text', 'Security issue detected'),
+                        severity=issue.get('issue_severity', 'medium'),
+                        line=issue.get('line_number', 0),
+                        column=issue.get('col_offset', 0),
+                        file_path='<inline>',
+                        description=issue.get('more_info', 'No additional information'),
+                        cwe=self._cwe_id((issue.get('issue_cwe') or {}).get('id'))
+                    )
+                    issues.append(security_issue)
+            except orjson.JSONDecodeError:
+                print("Failed to parse Bandit output")
+                return None
             
         except Exception as e:
             print(f"Bandit scan failed: {e}")
+            return None
         
         return issues
     
-    def _run_semgrep_scan(self, code: str, language: str) -> List[SecurityIssue]:
-        """Run Semgrep security scan on code"""
+    async def _run_semgrep_scan(self, temp_file: str) -> Optional[List[SecurityIssue]]:
+        """Run Semgrep security scan on a file (None if the scan failed)"""
         issues = []
         
         try:
-            # Create temporary file for scanning
-            file_extension = self._get_file_extension(language)
-            with tempfile.NamedTemporaryFile(mode='w', suffix=file_extension, delete=False) as f:
-                f_file = f.name
+            # Run Semgrep scan with security rules, batched with any other files queued meanwhile
+            findings = await self._semgrep_findings(temp_file)
             
-            # Run Semgrep scan with security rules
-            result = subprocess.run([
-                'semgrep', 'scan',
-                '--config', 'auto',
-                '--json',
-                temp_file
-            ], capture_output=True, text=True, timeout=30)
+            if findings is None:
+                return None
             
-            # Clean up temporary file
-            os.unlink(temp_file)
-            
-            if result.returncode == 0:
-                # Parse Semgrep output
-                try:
-                    semgrep_results = json.loads(result.stdout)
-                    for finding in semgrep_results.get('results', []):
-                        security_issue = SecurityIssue(
-                            rule_id=finding.get('check_id', 'Unknown'),
-                            message=finding.get('message', 'Security issue detected'),
-                            severity=finding.get('extra', {}).get('severity', 'medium'),
-                            line=finding.get('start', {}).get('line', 0),
-                            line=finding.get('start', {}).get('col', 0),
-                            file_path='<inline>',
-                            description=finding.get('extra', {}).get('message', 'No additional information')
-                        )
-                        issues.append(security_issue)
-                except json.JSONDecodeError:
-                    print("Failed to parse Semgrep output")
+            for finding in findings:
+                security_issue = SecurityIssue(
+                    rule_id=finding.get('check_id', 'Unknown'),
+                    message=finding.get('message', 'Security issue detected'),
+                    severity=finding.get('extra', {}).get('severity', 'medium'),
+                    line=finding.get('start', {}).get('line', 0),
+                    column=finding.get('start', {}).get('col', 0),
+                    file_path='<inline>',
+                    description=finding.get('extra', {}).get('message', 'No additional information'),
+                    cwe=self._cwe_id(finding.get('extra', {}).get('metadata', {}).get('cwe'))
+                )
+                issues.append(security_issue)
             
         except Exception as e:
             print(f"Semgrep scan failed: {e}")
+            return None
         
         return issues
     
-    def _get_file_extension(self, language: str) -> str) -> str:
+    async def _semgrep_findings(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        """Queue a file for the next batched Semgrep run and return its raw findings (None if the run failed)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._semgrep_pending.append((path, future))
+        if len(self._semgrep_pending) == 1:
+            loop.call_later(SEMGREP_BATCH_WINDOW, lambda: loop.create_task(self._flush_semgrep()))
+        return await future
+    
+    async def _flush_semgrep(self):
+        """Scan every queued file in one Semgrep process and hand each caller its own findings"""
+        batch, self._semgrep_pending = self._semgrep_pending, []
+        try:
+            output = await self._run_scanner(*self._semgrep_args, *(path for path, _ in batch))
+            results = orjson.loads(output) if output is not None else None
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        findings_by_path: Dict[str, List[Dict[str, Any]]] = {}
+        if results is not None:
+            for finding in results.get('results', []):
+                findings_by_path.setdefault(finding.get('path'), []).append(finding)
+        for path, future in batch:
+            if not future.done():
+                future.set_result(None if results is None else findings_by_path.get(path, []))
+    
+    @staticmethod
+    def _cwe_id(cwe: Any) -> Optional[str]:
+        """Normalize a scanner's CWE field (Bandit's number, Semgrep's string or list) to CWE-<n>"""
+        if isinstance(cwe, list):
+            cwe = cwe[0] if cwe else None
+        if isinstance(cwe, int):
+            return f"CWE-{cwe}" if cwe > 0 else None
+        match = CWE_RE.search(cwe) if isinstance(cwe, str) else None
+        return f"CWE-{match.group(1)}" if match else None
+    
+    def _get_file_extension(self, language: str) -> str:
         """Get file extension for given language"""
-        extensions = {
-            'python': '.py',
-            'javascript': '.js',
-            'typescript': '.ts',
-            'java': '.java',
-            'cpp': '.cpp',
-            'c': '.c'
-        }
-        return extensions.get(language.lower(), '.txt')
+        return LANGUAGE_EXTENSIONS.get(language.lower(), '.txt')
     
     def get_security_summary(self, issues: List[SecurityIssue]) -> Dict[str, Any]:
         """Generate security summary from issues"""
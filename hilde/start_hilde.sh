@@ -37,6 +37,9 @@ echo "🔍 Checking service health..."
 # Check completion service
 if curl -s http://localhost:8001/health > /dev/null; then
     echo "✅ Completion service is running"
+    # The model loads on first use; start loading it now without waiting
+    curl -s -X POST http://localhost:8001/warmup > /dev/null &
+    echo "🔥 Completion model warming up in the background"
 else
     echo "❌ Completion service failed to start"
 fi
@@ -6,12 +6,39 @@ Handles regeneration of code suffixes when tokens are replaced
 
 import re
 import ast
-from typing import List, Tuple, Optional
-from difflib import SequenceMatcher
+import functools
+from collections import Counter
+from typing import Iterable, Iterator, List, Tuple, Optional
+
+# Similarity results kept per distinct input; users try several replacements against one file,
+# so the same original suffix (and often the same candidates) is scored over and over
+SIMILARITY_CACHE_SIZE = 4096
+
+# Suffix similarity is a weighted average of string and AST similarity; a suffix that does not
+# parse gets a fixed low AST score, which caps its overall similarity
+STRING_WEIGHT = 0.7
+AST_WEIGHT = 0.3
+UNPARSEABLE_AST_SIMILARITY = 0.1
+UNPARSEABLE_MAX_SIMILARITY = STRING_WEIGHT + AST_WEIGHT * UNPARSEABLE_AST_SIMILARITY
+
+# Candidates decoded in the first batched call; the rest are only generated if none of these
+# is close enough to stop early (low temperatures come first and usually match best)
+FIRST_WAVE_CANDIDATES = 3
+
+@functools.lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def _ast_fingerprint(code: str) -> Optional[Counter]:
+    """Count of each AST node type in the code, or None if it does not parse (shared; do not mutate)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return Counter(type(node).__name__ for node in ast.walk(tree))
 
 class SuffixPreservationService:
     def __init__(self):
         self.similarity_threshold = 0.7
+        # A candidate this close to the original is kept without generating or scoring the rest
+        self.early_exit_similarity = 0.95
     
     def regenerate_suffix(self, original_code: str, new_token: str, position: int, 
                          completion_engine) -> str:
@@ -27,8 +54,12 @@ class SuffixPreservationService:
         Returns:
             Regenerated suffix that best preserves the original intent
         """
+        # Re-selecting the token already at the position changes nothing
+        if self._is_same_token(original_code, new_token, position):
+            return original_code[position + len(new_token):]
+        
         try:
-            # Generate multiple candidate suffixes
+            # Generate multiple candidate suffixes (lazily, so selection can stop early)
             candidates = self._generate_candidate_suffixes(
                 original_code, new_token, position, completion_engine
             )
@@ -45,57 +76,89 @@ class SuffixPreservationService:
             # Return original suffix as fallback
             return original_code[position + len(new_token):]
     
+    @staticmethod
+    def _is_same_token(original_code: str, new_token: str, position: int) -> bool:
+        """Whether new_token is exactly the whole token at position, not just a prefix of a longer word"""
+        if not new_token or not original_code.startswith(new_token, position):
+            return False
+        end = position + len(new_token)
+        # A word token followed by another word character only matches part of the existing word
+        return not (re.match(r'\w', new_token[-1]) and re.match(r'\w', original_code[end:end + 1]))
+    
     def _generate_candidate_suffixes(self, original_code: str, new_token: str, 
-                                   position: int, completion_engine) -> List[str]:
-        """Generate multiple candidate suffixes"""
-        candidates = []
+                                   position: int, completion_engine) -> Iterator[str]:
+        """Generate multiple candidate suffixes, yielding each as soon as it is available"""
+        # Get the context before the replacement, and generate from the new token
+        prompt = original_code[:position] + new_token
         
-        # Get the context before the replacement
-        context = original_code[:position]
+        # Generate 10 different completions, adjusting temperature for diversity
+        temperatures = [0.1 + (i * 0.1) for i in range(10)]
         
-        # Generate 10 different completions
-        for i in range(10):
+        for completion in self._generate_completions(prompt, temperatures, completion_engine):
+            if completion is None:
+                continue
+            # Extract the suffix (everything after the new token)
+            if completion.startswith(prompt):
+                yield completion[len(prompt):]
+            else:
+                # Fallback: use the completion as suffix
+                yield completion
+    
+    @staticmethod
+    def _generate_completions(prompt: str, temperatures: List[float],
+                              completion_engine) -> Iterator[Optional[str]]:
+        """Completions of the prompt at each temperature, batched when the engine supports it"""
+        if hasattr(completion_engine, 'generate_completions'):
+            # Each batched call decodes its candidates together; the second wave is requested
+            # only if selection is still consuming candidates after the first
+            for wave in (temperatures[:FIRST_WAVE_CANDIDATES], temperatures[FIRST_WAVE_CANDIDATES:]):
+                if not wave:
+                    continue
+                try:
+                    yield from completion_engine.generate_completions(
+                        [prompt] * len(wave), max_tokens=100, temperatures=wave
+                    )
+                except Exception as e:
+                    print(f"Candidate generation failed: {e}")
+            return
+        
+        # Otherwise one call per candidate, made only if selection is still consuming them
+        for i, temperature in enumerate(temperatures):
             try:
-                # Adjust temperature for diversity
-                temperature = 0.1 + (i * 0.1)
-                
-                # Generate completion from the new token
-                prompt = context + new_token
-                completion = completion_engine.generate_completion(
+                yield completion_engine.generate_completion(
                     prompt, max_tokens=100, temperature=temperature
                 )
-                
-                # Extract the suffix (everything after the new token)
-                if completion.startswith(prompt):
-                    suffix = completion[len(prompt):]
-                    candidates.append(suffix)
-                else:
-                    # Fallback: use the completion as suffix
-                    candidates.append(completion)
-                    
             except Exception as e:
                 print(f"Candidate {i} generation failed: {e}")
-                continue
-        
-        return candidates
     
-    def _select_best_suffix(self, candidates: List[str], original_code: str, 
+    def _select_best_suffix(self, candidates: Iterable[str], original_code: str, 
                            position: int) -> str:
-        """Select the best suffix based on similarity to original"""
-        if not candidates:
-            return ""
-        
+        """Select the best suffix based on similarity to original, scoring candidates as they arrive"""
         original_suffix = original_code[position:]
-        best_candidate = candidates[0]
+        best_candidate = None
         best_similarity = 0.0
         
         for candidate in candidates:
+            if best_candidate is None:
+                best_candidate = candidate
+            
+            # Once a candidate beats anything an unparseable one could score, those are skipped
+            # after a (cached) parse, without comparing strings
+            if (best_similarity >= UNPARSEABLE_MAX_SIMILARITY and candidate != original_suffix
+                    and _ast_fingerprint(candidate) is None):
+                continue
+            
             # Calculate similarity using multiple metrics
             similarity = self._calculate_similarity(candidate, original_suffix)
             
             if similarity > best_similarity:
                 best_similarity = similarity
                 best_candidate = candidate
+                if best_similarity >= self.early_exit_similarity:
+                    break
+        
+        if best_candidate is None:
+            return ""
         
         # Only use candidate if similarity is above threshold
         if best_similarity >= self.similarity_threshold:
@@ -108,46 +171,45 @@ class SuffixPreservationService:
         """Calculate similarity between candidate and original suffix"""
         if not candidate or not original:
             return 0.0
+        # Common when the replacement does not force the suffix to change
+        if candidate == original:
+            return 1.0
         
-        # Use SequenceMatcher for string similarity
-        matcher = SequenceMatcher(None, candidate, original)
-        string_similarity = matcher.ratio()
+        # Character n-gram overlap is linear in the suffix lengths, unlike difflib's matching
+        string_similarity = self._ngram_similarity(candidate, original)
         
         # Try to parse as AST for structural similarity
         ast_similarity = self._calculate_ast_similarity(candidate, original)
         
         # Combine similarities (weighted average)
-        combined_similarity = (string_similarity * 0.7) + (ast_similarity * 0.3)
+        combined_similarity = (string_similarity * STRING_WEIGHT) + (ast_similarity * AST_WEIGHT)
         
         return combined_similarity
     
+    @staticmethod
+    @functools.lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+    def _ngram_similarity(a: str, b: str, k: int = 4) -> float:
+        """Jaccard similarity of the two strings' sets of k-character n-grams"""
+        # A string shorter than k counts as a single n-gram
+        grams_a = {a[i:i + k] for i in range(max(1, len(a) - k + 1))}
+        grams_b = {b[i:i + k] for i in range(max(1, len(b) - k + 1))}
+        return len(grams_a & grams_b) / len(grams_a | grams_b)
+    
     def _calculate_ast_similarity(self, candidate: str, original: str) -> float:
         """Calculate AST-based similarity"""
-        try:
-            candidate_ast = ast.parse(candidate)
-            original_ast = ast.parse(original)
-            
-            # Simple AST node count comparison
-            candidate_nodes = self._count_ast_nodes(candidate_ast)
-            original_nodes = self._count_ast_nodes(original_ast)
-            
-            if original_nodes == 0:
-                return 0.0
-            
-            # Calculate similarity based on node count ratio
-            ratio = min(candidate_nodes, original_nodes) / max(candidate_nodes, original_nodes)
-            return ratio
-            
-        except SyntaxError:
+        if candidate == original:
+            return 1.0
+        # Compare which kinds of nodes each suffix contains (each suffix is parsed once, then served from the cache)
+        candidate_nodes = _ast_fingerprint(candidate)
+        original_nodes = _ast_fingerprint(original)
+        
+        if candidate_nodes is None or original_nodes is None:
             # If parsing fails, return low similarity
-            return 0.1
-    
-    def _count_ast_nodes(self, ast_tree) -> int:
-        """Count AST nodes recursively"""
-        count = 1
-        for child in ast.iter_child_nodes(ast_tree):
-            count += self._count_ast_nodes(child)
-        return count
+            return UNPARSEABLE_AST_SIMILARITY
+        
+        # Weighted Jaccard over node type counts
+        shared = sum((candidate_nodes & original_nodes).values())
+        return shared / sum((candidate_nodes | original_nodes).values())
 
 # Example usage
 if __name__ == "__main__":
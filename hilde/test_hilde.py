@@ -8,18 +8,21 @@ import asyncio
 import json
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 class HILDETester:
     def __init__(self):
         self.base_url = "http://localhost:8000"
         self.test_results = {}
+        # One pooled session so every check reuses its keep-alive connections
+        self.session = requests.Session()
     
     def test_completion_service(self):
         """Test the completion service directly"""
         print("🔍 Testing Completion Service...")
         try:
-            response = requests.get("http://localhost:8001/health", timeout=5)
+            response = self.session.get("http://localhost:8001/health", timeout=5)
             if response.status_code == 200:
                 print("✅ Completion service is running")
                 self.test_results['completion_service'] = 'PASS'
@@ -37,7 +40,7 @@ class HILDETester:
         """Test the analysis service directly"""
         print("🔍 Testing Analysis Service...")
         try:
-            response = requests.get("http://localhost:8002/health", timeout=5)
+            response = self.session.get("http://localhost:8002/health", timeout=5)
             if response.status_code == 200:
                 print("✅ Analysis service is running")
                 self.test_results['analysis_service'] = 'PASS'
@@ -55,7 +58,7 @@ class HILDETester:
         """Test the main API gateway"""
         print("🔍 Testing API Gateway...")
         try:
-            response = requests.get(f"{self.base_url}/health", timeout=5)
+            response = self.session.get(f"{self.base_url}/health", timeout=5)
             if response.status_code == 200:
                 print("✅ API gateway is running")
                 self.test_results['api_gateway'] = 'PASS'
@@ -75,7 +78,7 @@ class HILDETester:
         try:
             test_prompt = "def hash_password(password):"
             
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/hilde/completion",
                 json={
                     "prompt": test_prompt,
@@ -230,10 +233,17 @@ def hash_password(password):
         """Run all tests and generate report"""
         print("🚀 Starting HILDE System Tests...\n")
         
-        tests = [
+        # The health checks only wait on the network, so they run together (total wait is the slowest one)
+        health_checks = [
             self.test_completion_service,
             self.test_analysis_service,
-            self.test_api_gateway,
+            self.test_api_gateway
+        ]
+        with ThreadPoolExecutor(max_workers=len(health_checks)) as executor:
+            list(executor.map(self._run_test, health_checks))
+        print()
+        
+        tests = [
             self.test_hilde_completion,
             self.test_security_integration,
             self.test_suffix_preservation,
@@ -242,15 +252,18 @@ def hash_password(password):
         ]
         
         for test in tests:
-            try:
-                test()
-            except Exception as e:
-                print(f"❌ Test {test.__name__} crashed: {e}")
-                self.test_results[test.__name__] = 'CRASH'
+            self._run_test(test)
             print()
         
         self.generate_test_report()
     
+    def _run_test(self, test):
+        try:
+            test()
+        except Exception as e:
+            print(f"❌ Test {test.__name__} crashed: {e}")
+            self.test_results[test.__name__] = 'CRASH'
+    
     def generate_test_report(self):
         """Generate a comprehensive test report"""
         print("📊 Test Results Summary")
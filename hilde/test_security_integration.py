@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for SecurityIntegrationService result merging and Semgrep batching
+Scanner processes are replaced with canned JSON reports, so neither tool needs to be installed
+"""
+
+import asyncio
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import orjson
+
+from security_integration import SecurityIntegrationService
+
+def _service(semgrep_runs: List[Tuple[str, ...]]) -> SecurityIntegrationService:
+    """A service whose scanners report MD5 use on line 2, by CWE, with differing rule ids and columns"""
+    service = SecurityIntegrationService()
+
+    async def run_scanner(*args: str, stdin: Optional[str] = None) -> Optional[bytes]:
+        if args[0] == 'bandit':
+            return orjson.dumps({'results': [
+                {'issue_text': 'Use of weak MD5 hash', 'issue_severity': 'HIGH', 'line_number': 2,
+                 'col_offset': 4, 'issue_cwe': {'id': 327}},
+                {'issue_text': 'Use of assert', 'issue_severity': 'LOW', 'line_number': 3,
+                 'col_offset': 0, 'issue_cwe': {'id': 703}},
+            ]})
+        paths = args[len(service._semgrep_args):]
+        semgrep_runs.append(tuple(paths))
+        results = []
+        for path in paths:
+            results.append({'path': path, 'check_id': 'python.lang.security.insecure-hash-md5',
+                            'start': {'line': 2, 'col': 5},
+                            'extra': {'metadata': {'cwe': ['CWE-327: Use of a Broken or Risky Cryptographic Algorithm']}}})
+            # One more finding per line of the file, so each caller can tell its findings apart
+            for line in range(1, Path(path).read_text().count('\n') + 1):
+                results.append({'path': path, 'check_id': 'custom.no-cwe', 'start': {'line': line, 'col': 1},
+                                'extra': {}})
+        return orjson.dumps({'results': results})
+
+    service._run_scanner = run_scanner
+    return service
+
+def test_duplicate_cwe_reported_once():
+    """Bandit and Semgrep findings on the same line and CWE are merged; others are kept"""
+    service = _service([])
+    issues = service.scan_code_security("import hashlib\nhashlib.md5(b'x')\nassert True\n")
+    keys = sorted((issue.line, issue.cwe or issue.rule_id) for issue in issues)
+    assert keys == [(1, 'custom.no-cwe'), (2, 'CWE-327'), (2, 'custom.no-cwe'), (3, 'CWE-703'),
+                    (3, 'custom.no-cwe')]
+    # The first scanner's finding is the one kept
+    assert [issue.column for issue in issues if issue.cwe == 'CWE-327'] == [4]
+
+def test_cwe_id_normalization():
+    assert SecurityIntegrationService._cwe_id(327) == 'CWE-327'
+    assert SecurityIntegrationService._cwe_id(0) is None
+    assert SecurityIntegrationService._cwe_id('CWE-89: SQL Injection') == 'CWE-89'
+    assert SecurityIntegrationService._cwe_id(['CWE-79: XSS', 'CWE-80']) == 'CWE-79'
+    assert SecurityIntegrationService._cwe_id([]) is None
+    assert SecurityIntegrationService._cwe_id(None) is None
+
+def test_concurrent_scans_share_one_semgrep_run():
+    """Scans started together run Semgrep once, and each gets only its own file's findings"""
+    semgrep_runs: List[Tuple[str, ...]] = []
+    service = _service(semgrep_runs)
+    codes = ["x = 1\n" * lines for lines in (1, 2, 3)]
+
+    async def scan_all():
+        return await asyncio.gather(*(service.ascan_code_security(code, 'javascript') for code in codes))
+
+    results = asyncio.run(scan_all())
+    assert len(semgrep_runs) == 1 and len(semgrep_runs[0]) == 3
+    assert [len(issues) for issues in results] == [2, 3, 4]
+
+    # Repeated scans are served from the cache without running Semgrep again
+    assert [len(issues) for issues in asyncio.run(scan_all())] == [2, 3, 4]
+    assert len(semgrep_runs) == 1
+
+def test_scan_code_security_refuses_running_loop():
+    """The blocking entry point must not be called from inside an event loop"""
+    service = _service([])
+
+    async def call_blocking():
+        service.scan_code_security("x = 1\n")
+
+    try:
+        asyncio.run(call_blocking())
+    except RuntimeError as e:
+        assert "ascan_code_security" in str(e)
+    else:
+        raise AssertionError("scan_code_security() ran inside an event loop")
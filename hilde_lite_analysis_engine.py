@@ -5,25 +5,225 @@ Uses GPT-4 API to analyze complete code blocks
 Provides human-readable explanations for code quality, security, and best practices
 """
 
-import openai
+import httpx
+import orjson
 import os
 import json
-from typing import Dict, Any
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from openai import OpenAI
+
+# Positions explained per GPT-4 call, and how many of those calls may be in flight at once
+POSITIONS_PER_CALL = 20
+MAX_CONCURRENT_CALLS = 8
+# Suggested location for the opt-in response cache: stored on disk by request content, so repeated
+# runs (tests, demos) skip the API
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "hilde" / "llm-cache"
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+# Models without response_format={"type": "json_object"}; every newer chat model returns bare JSON with it
+NO_JSON_MODE_MODELS = ("gpt-4", "gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0314", "gpt-4-32k-0613")
+
+# Static system prompt sent byte-for-byte first in every request, covering every task, so each
+# user message is only {"task": ..., "payload": ...}
+SYSTEM_PROMPT = """You are an expert code analyzer for HiLDe-Lite (Human-in-the-Loop Decoding), specializing in Python security, correctness, and best practices. HiLDe-Lite shows developers the code a model generated together with the alternative tokens it considered, so they can notice and steer the decisions that matter.
+
+Your analysis should focus on:
+1. Security vulnerabilities (injection attacks, weak cryptography, unsafe evaluation, hardcoded secrets, etc.)
+2. Code correctness and potential bugs (changed operators, off-by-one boundaries, None handling, missing error handling)
+3. Best practices and code quality
+4. Performance implications (algorithmic complexity, repeated work in loops, blocking I/O)
+5. Maintainability and readability
+
+Provide clear, actionable feedback that helps developers write better, more secure code.
+
+## Input
+
+Every user message is a JSON object {"task": ..., "payload": ...}. Perform the named task on the payload and respond with a single JSON object in that task's output format. Do not include any text outside the JSON object.
+
+## Task "analyze_code"
+
+The payload is {"code": "..."}: a complete Python code block. Assess it as a whole.
+
+Output format:
+{
+    "analysis": "Overall assessment of the code quality and functionality",
+    "security_issues": [
+        "List any security vulnerabilities or concerns"
+    ],
+    "best_practices": [
+        "List any coding best practices that should be followed"
+    ],
+    "overall_rating": "Excellent|Good|Fair|Poor",
+    "recommendations": [
+        "Specific recommendations for improvement"
+    ]
+}
+
+Use empty lists when there is nothing to report. Rate "Poor" when the code has a security vulnerability or does not work, "Fair" when it works but has notable issues, "Good" when only minor improvements remain and "Excellent" otherwise.
+
+## Task "analyze_alternatives"
+
+The payload is {"code": "...", "positions": [{"i": 0, "tokens": ["...", "..."]}, ...]}: Python code generated from a prompt and, for each listed position, the tokens the model chose between there (most likely first, which is the one in the code). Tokens are model sub-word tokens and may be fragments of identifiers, operators or whitespace.
+
+For every position, imagine the code with each token in turn and explain each token in order:
+- "explanation": one sentence on what choosing this token means
+- "category": "Significant" (affects behavior, security or efficiency), "Minor" (stylistic or equivalent), or "Incorrect" (would not parse or run)
+- "importance_score": 0.0 to 1.0; 0.8-1.0 for security-relevant changes or clearly different results, 0.5-0.8 for edge-case behavior or notable performance impact, 0.2-0.5 for small behavioral or readability impact, 0.0-0.2 when the tokens are equivalent
+
+Output format, with exactly one result per position and one analysis per token:
+{
+    "results": [
+        {
+            "i": 0,
+            "analyses": [
+                {"explanation": "One sentence on what choosing this token means", "category": "Significant|Minor|Incorrect", "importance_score": 0.5}
+            ]
+        }
+    ]
+}"""
+# Worked examples, appended for models with automatic prompt caching (gpt-4o and newer): OpenAI
+# caches prefixes longer than 1024 tokens, which the examples lift the prompt past. The original
+# gpt-4 snapshots (NO_JSON_MODE_MODELS) have no caching, so there they would be billed every call.
+PROMPT_EXAMPLES = """
+
+## Examples
+
+Input:
+{"task": "analyze_alternatives", "payload": {"code": "def hash_password(password):\n    return hashlib.md5(password.encode()).hexdigest()", "positions": [{"i": 7, "tokens": ["md5", "sha256", "scrypt"]}]}}
+
+Output:
+{"results": [{"i": 7, "analyses": [{"explanation": "MD5 is fast and broken, so hashed passwords can be brute-forced or collided.", "category": "Significant", "importance_score": 0.9}, {"explanation": "SHA-256 is collision resistant but still too fast for password storage without a salt and key stretching.", "category": "Significant", "importance_score": 0.7}, {"explanation": "scrypt is a memory-hard key derivation function designed for password hashing, but needs salt and cost arguments.", "category": "Significant", "importance_score": 0.8}]}]}
+
+Input:
+{"task": "analyze_code", "payload": {"code": "def get_user(cursor, user_id):\n    cursor.execute(\"SELECT * FROM users WHERE id = \" + user_id)\n    return cursor.fetchone()"}}
+
+Output:
+{"analysis": "Fetches a user row by id, but builds the SQL query by string concatenation.", "security_issues": ["SQL injection: user_id is concatenated into the query"], "best_practices": ["Use parameterized queries", "Select only the needed columns"], "overall_rating": "Poor", "recommendations": ["cursor.execute(\"SELECT * FROM users WHERE id = %s\", (user_id,))"]}"""
+SYSTEM_PREAMBLE = SYSTEM_PROMPT + PROMPT_EXAMPLES
+
+class RateLimiter:
+    """Paces GPT-4 calls from the worker threads under the account's per-minute request and token limits"""
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # When each limit's last minute of capacity would be fully spent back; a minute ahead of now
+        # means the limit is exhausted
+        now = time.monotonic()
+        self._requests_busy_until = now
+        self._tokens_busy_until = now
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: int):
+        """Reserve capacity for one call of the given token cost, sleeping until it is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests_busy_until = max(self._requests_busy_until, now) + 60 / self.requests_per_minute
+            self._tokens_busy_until = (max(self._tokens_busy_until, now)
+                                       + 60 * min(tokens, self.tokens_per_minute) / self.tokens_per_minute)
+            delay = max(self._requests_busy_until, self._tokens_busy_until) - now - 60
+        # The reservation is already made, so threads sleep concurrently rather than queueing on the lock
+        if delay > 0:
+            time.sleep(delay)
+
+class JSONStreamScanner:
+    """Follows a streamed JSON object, reporting each object in its top-level arrays as soon as it closes"""
+    
+    def __init__(self, on_item: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.on_item = on_item
+        self.parts: List[str] = []
+        # Open brackets outside string literals; len(self.stack) is the nesting depth
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escaped = False
+        # Text of the array item being read, while one is open
+        self.item: Optional[List[str]] = None
+        self.done = False
+    
+    def feed(self, delta: str) -> bool:
+        """Consume the next piece of the response; True once the root object is complete"""
+        self.parts.append(delta)
+        if self.done:
+            return True
+        item_start = 0
+        for position, char in enumerate(delta):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if char == "{" and self.stack == ["{", "["] and self.on_item is not None:
+                    self.item = []
+                    item_start = position
+                self.stack.append(char)
+            elif char in "}]" and self.stack:
+                self.stack.pop()
+                if self.item is not None and len(self.stack) == 2:
+                    self.item.append(delta[item_start:position + 1])
+                    self._emit("".join(self.item))
+                    self.item = None
+                if not self.stack:
+                    self.done = True
+                    return True
+        if self.item is not None:
+            self.item.append(delta[item_start:])
+        return False
+    
+    def text(self) -> str:
+        return "".join(self.parts)
+    
+    def _emit(self, item: str):
+        try:
+            value = json.loads(item)
+        except ValueError:
+            return
+        if isinstance(value, dict):
+            self.on_item(value)
 
 class GPT4AnalysisEngine:
-    def __init__(self, api_key: str = None, model: str = "gpt-4"):
+    _decoder = json.JSONDecoder()
+    
+    def __init__(self, api_key: str = None, model: str = "gpt-4",
+                 cache_dir: Optional[str] = None, cache_ttl: float = DEFAULT_CACHE_TTL):
         """
         Initialize the GPT-4 analysis engine
         
         Args:
             api_key: OpenAI API key (if None, will try to get from environment)
-            model: OpenAI model to use (default: gpt-4)
+            model: OpenAI model to use (default: gpt-4; gpt-4o or newer adds prompt caching and JSON mode)
+            cache_dir: Directory for caching GPT-4 responses (e.g. DEFAULT_CACHE_DIR); None disables the cache
+            cache_ttl: Seconds a cached response stays valid
         """
         self.model = model
+        self.system_prompt = SYSTEM_PROMPT if model in NO_JSON_MODE_MODELS else SYSTEM_PREAMBLE
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.cache_ttl = cache_ttl
+        self.stats = {"cache_hits": 0, "cache_misses": 0}
+        self._stats_lock = threading.Lock()
+        # Sized from the rate limit headers of the first response
+        self.rate_limiter: Optional[RateLimiter] = None
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         
         if self.api_key:
-            openai.api_key = self.api_key
+            # One client with a keep-alive pool, so only the first call pays the TCP/TLS handshake
+            self.client = OpenAI(
+                api_key=self.api_key,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_connections=MAX_CONCURRENT_CALLS * 2,
+                                        max_keepalive_connections=MAX_CONCURRENT_CALLS),
+                    timeout=30.0
+                )
+            )
             print(f"✅ GPT-4 Analysis Engine initialized with {model}")
         else:
             print("❌ Error: No OpenAI API key found. Set OPENAI_API_KEY environment variable.")
@@ -40,20 +240,9 @@ class GPT4AnalysisEngine:
             Dictionary containing analysis results
         """
         try:
-            # Create analysis prompt
-            analysis_prompt = self._create_analysis_prompt(code)
-            
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt()},
-                    {"role": "user", "content": analysis_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
+            content = self._complete(self._chat_request("analyze_code", {"code": code}, max_tokens=500))
             
-            analysis = self._parse_analysis_response(response.choices[0].message.content)
+            analysis = self._parse_analysis_response(content)
             return analysis
             
         except Exception as e:
@@ -65,52 +254,287 @@ class GPT4AnalysisEngine:
                 "overall_rating": "Error"
             }
     
-    def _create_analysis_prompt(self, code: str) -> str:
-        """Create prompt for GPT-4 analysis of complete code block"""
-        return f"""Analyze this Python code for security, correctness, and best practices:
-
-```python
-{code}
-```
-
-Provide a comprehensive analysis in this JSON format:
-{{
-    "analysis": "Overall assessment of the code quality and functionality",
-    "security_issues": [
-        "List any security vulnerabilities or concerns"
-    ],
-    "best_practices": [
-        "List any coding best practices that should be followed"
-    ],
-    "overall_rating": "Excellent|Good|Fair|Poor",
-    "recommendations": [
-        "Specific recommendations for improvement"
-    ]
-}}"""
+    def analyze_alternatives(self, prompt: str, completion: str,
+                             token_alternatives: List[List[Dict[str, Any]]],
+                             on_position: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None
+                             ) -> List[List[Dict[str, Any]]]:
+        """
+        Explain the token alternatives at every position with a single GPT-4 call
+        
+        Args:
+            prompt: Code prompt that was completed
+            completion: The generated completion
+            token_alternatives: Candidate tokens for each position, most likely first
+            on_position: Called with (position, analyses) as each position's analyses stream in,
+                so callers can render them early; may be called from several threads at once
+            
+        Returns:
+            The same alternatives, each with an "analysis" entry added
+        """
+        # The calls only wait on the network, so they run concurrently
+        chunks = self._position_chunks(token_alternatives)
+        analyses: Dict[int, List[Dict[str, Any]]] = {}
+        if len(chunks) == 1:
+            analyses = self._analyze_positions(prompt, completion, chunks[0], on_position)
+        elif chunks:
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CALLS, len(chunks))) as executor:
+                for chunk_analyses in executor.map(
+                        lambda chunk: self._analyze_positions(prompt, completion, chunk, on_position), chunks):
+                    analyses.update(chunk_analyses)
+        
+        return self._attach_analyses(token_alternatives, analyses)
     
-    def _get_system_prompt(self) -> str:
-        """System prompt for GPT-4"""
-        return """You are an expert code analyzer specializing in Python security, correctness, and best practices. 
-
-Your analysis should focus on:
-1. Security vulnerabilities (injection attacks, weak cryptography, etc.)
-2. Code correctness and potential bugs
-3. Best practices and code quality
-4. Performance implications
-5. Maintainability and readability
-
-Provide clear, actionable feedback that helps developers write better, more secure code."""
+    def analyze_alternatives_batch(self, jobs: List[Tuple[str, str, List[List[Dict[str, Any]]]]],
+                                   poll_interval: float = 30.0) -> List[List[List[Dict[str, Any]]]]:
+        """
+        Explain the token alternatives of many completions offline through the OpenAI Batch API
+        
+        Batch requests cost half as much and do not count against the per-minute rate limits, but
+        may take up to 24 hours; use this for scripted runs over large corpora, not interactively.
+        
+        Args:
+            jobs: (prompt, completion, token_alternatives) for each completion
+            poll_interval: Seconds between batch status checks
+            
+        Returns:
+            Each job's token alternatives, with an "analysis" entry added to every token
+        """
+        analyses: List[Dict[int, List[Dict[str, Any]]]] = [{} for _ in jobs]
+        # custom_id -> (job index, cache path) for requests the cache could not answer
+        pending: Dict[str, Tuple[int, Optional[Path]]] = {}
+        lines = []
+        for job, (prompt, completion, token_alternatives) in enumerate(jobs):
+            for chunk, positions in enumerate(self._position_chunks(token_alternatives)):
+                request = self._alternatives_request(prompt, completion, positions)
+                cache_path = self._cache_path(request)
+                content = self._load_cached(cache_path) if cache_path is not None else None
+                if content is not None:
+                    analyses[job].update(self._parse_alternatives_response(content))
+                    continue
+                custom_id = f"job-{job}-chunk-{chunk}"
+                pending[custom_id] = (job, cache_path)
+                lines.append(json.dumps({"custom_id": custom_id, "method": "POST",
+                                         "url": "/v1/chat/completions", "body": request}))
+        
+        if lines:
+            for custom_id, content in self._run_batch(lines, poll_interval).items():
+                job, cache_path = pending[custom_id]
+                analyses[job].update(self._parse_alternatives_response(content))
+                if cache_path is not None and self._has_json_object(content):
+                    self._store_cached(cache_path, content)
+        
+        return [self._attach_analyses(token_alternatives, job_analyses)
+                for (_, _, token_alternatives), job_analyses in zip(jobs, analyses)]
+    
+    def _run_batch(self, lines: List[str], poll_interval: float) -> Dict[str, str]:
+        """Submit chat completion requests as one batch, wait for it, and return each successful reply by custom_id"""
+        try:
+            batch_file = self.client.files.create(file=("alternatives.jsonl", "\n".join(lines).encode()),
+                                                  purpose="batch")
+            batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                               completion_window="24h")
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = self.client.batches.retrieve(batch.id)
+            
+            # Expired or cancelled batches still return whatever finished
+            if batch.output_file_id is None:
+                print(f"❌ GPT-4 batch {batch.id} ended with status {batch.status}")
+                return {}
+            contents = {}
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if response.get("status_code") == 200:
+                    contents[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            return contents
+        except Exception as e:
+            print(f"❌ GPT-4 batch analysis failed: {e}")
+            return {}
+    
+    @staticmethod
+    def _position_chunks(token_alternatives: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """Positions with a real choice, grouped into one request per POSITIONS_PER_CALL"""
+        # Sent together (list in, list out) instead of one request each; long completions are
+        # split so each reply stays within its token budget
+        positions = [
+            {"i": i, "tokens": [alt["token"] for alt in alt_group]}
+            for i, alt_group in enumerate(token_alternatives) if len(alt_group) >= 2
+        ]
+        return [positions[i:i + POSITIONS_PER_CALL] for i in range(0, len(positions), POSITIONS_PER_CALL)]
+    
+    @staticmethod
+    def _attach_analyses(token_alternatives: List[List[Dict[str, Any]]],
+                         analyses: Dict[int, List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        for i, alt_group in enumerate(token_alternatives):
+            position_analyses = analyses.get(i, [])
+            for j, alt in enumerate(alt_group):
+                if j < len(position_analyses) and isinstance(position_analyses[j], dict):
+                    alt['analysis'] = position_analyses[j]
+                else:
+                    alt['analysis'] = {
+                        "explanation": "Analysis unavailable",
+                        "category": "Minor",
+                        "importance_score": 0.0
+                    }
+        
+        return token_alternatives
+    
+    def _analyze_positions(self, prompt: str, completion: str, positions: List[Dict[str, Any]],
+                           on_position: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None
+                           ) -> Dict[int, List[Dict[str, Any]]]:
+        """Explain the tokens at the given positions in one GPT-4 call"""
+        on_result = None
+        if on_position is not None:
+            def on_result(result: Dict[str, Any]):
+                try:
+                    i = int(result["i"])
+                except (KeyError, TypeError, ValueError):
+                    return
+                on_position(i, result.get("analyses", []))
+        
+        try:
+            content = self._complete(self._alternatives_request(prompt, completion, positions), on_result)
+            return self._parse_alternatives_response(content)
+        except Exception as e:
+            print(f"❌ GPT-4 alternatives analysis failed: {e}")
+            return {}
+    
+    def _alternatives_request(self, prompt: str, completion: str, positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self._chat_request(
+            "analyze_alternatives", {"code": prompt + completion, "positions": positions},
+            # Room for a short analysis of every token
+            max_tokens=100 + 60 * sum(len(position["tokens"]) for position in positions)
+        )
+    
+    def _chat_request(self, task: str, payload: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+        """Chat completion parameters for one task; only the user message varies between requests"""
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": orjson.dumps({"task": task, "payload": payload}).decode()}
+            ],
+            "temperature": 0.1,
+            "max_tokens": max_tokens
+        }
+        if self.model not in NO_JSON_MODE_MODELS:
+            # JSON mode makes the reply the bare object, so parsing needs no extraction
+            request["response_format"] = {"type": "json_object"}
+        return request
+    
+    def _cache_path(self, request: Dict[str, Any]) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        # temperature=0.1 is close enough to deterministic that identical requests can share a response
+        key = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+    
+    def _complete(self, request: Dict[str, Any],
+                  on_item: Optional[Callable[[Dict[str, Any]], None]] = None) -> str:
+        """
+        Run one GPT-4 chat completion, answering identical requests from the on-disk cache
+        
+        The reply is streamed, and on_item receives each object of the reply's top-level arrays
+        as soon as it is complete (all at once for cached replies).
+        """
+        scanner = JSONStreamScanner(on_item)
+        cache_path = self._cache_path(request)
+        if cache_path is not None:
+            content = self._load_cached(cache_path)
+            self._count("cache_hits" if content is not None else "cache_misses")
+            if content is not None:
+                scanner.feed(content)
+                return content
+        
+        if self.rate_limiter is not None:
+            # Cost: the prompt at about 4 characters per token, plus everything the reply may use
+            prompt_chars = sum(len(message["content"]) for message in request["messages"])
+            self.rate_limiter.acquire(prompt_chars // 4 + request["max_tokens"])
+        raw = self.client.chat.completions.with_raw_response.create(**request, stream=True)
+        if self.rate_limiter is None:
+            self._init_rate_limiter(raw.headers)
+        stream = raw.parse()
+        try:
+            for event in stream:
+                delta = event.choices[0].delta.content if event.choices else None
+                # JSON mode guarantees well-formed JSON, so the closing brace is the end of the reply;
+                # stop decoding (and billing) whatever would follow
+                if delta and scanner.feed(delta) and "response_format" in request:
+                    break
+        finally:
+            stream.close()
+        content = scanner.text()
+        if cache_path is not None and self._has_json_object(content):
+            self._store_cached(cache_path, content)
+        return content
+    
+    def _init_rate_limiter(self, headers):
+        try:
+            requests_per_minute = int(headers.get("x-ratelimit-limit-requests", 0))
+            tokens_per_minute = int(headers.get("x-ratelimit-limit-tokens", 0))
+        except ValueError:
+            return
+        if requests_per_minute > 0 and tokens_per_minute > 0:
+            self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    
+    def _count(self, stat: str):
+        with self._stats_lock:
+            self.stats[stat] += 1
+    
+    def _load_cached(self, path: Path) -> Optional[str]:
+        try:
+            if time.time() - path.stat().st_mtime > self.cache_ttl:
+                return None
+            return path.read_text()
+        except OSError:
+            # Missing or unreadable entries are fetched again and overwritten
+            return None
+    
+    def _store_cached(self, path: Path, content: str):
+        """Store a response via a temporary file swapped into place, so a crash never leaves it truncated"""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # The cache is an optimization; the response is already in hand
+    
+    @classmethod
+    def _load_json_object(cls, content: str) -> Any:
+        """Parse the JSON object in a response (ValueError if there is none)"""
+        try:
+            # JSON mode output is normally the bare object
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Otherwise parse the first object embedded in surrounding text
+            return cls._decoder.raw_decode(content, content.index("{"))[0]
+    
+    def _has_json_object(self, content: str) -> bool:
+        """Only well-formed responses are cached, so a malformed one is retried next time"""
+        try:
+            self._load_json_object(content)
+            return True
+        except ValueError:
+            return False
+    
+    def _parse_alternatives_response(self, content: str) -> Dict[int, List[Dict[str, Any]]]:
+        """Map each position to its token analyses (empty if the response cannot be parsed)"""
+        try:
+            results = self._load_json_object(content).get("results", [])
+            return {int(result["i"]): result.get("analyses", []) for result in results}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return {}
     
     def _parse_analysis_response(self, content: str) -> Dict[str, Any]:
         """Parse GPT-4 response"""
         try:
-            # Try to extract JSON from response
-            if "{" in content and "}" in content:
-                start = content.find("{")
-                end = content.rfind("}") + 1
-                json_str = content[start:end]
-                return json.loads(json_str)
-        except:
+            analysis = self._load_json_object(content)
+            if isinstance(analysis, dict):
+                return analysis
+        except ValueError:
             pass
         
         # Fallback parsing
@@ -20,6 +20,7 @@ def install_dependencies():
         "flask>=2.3.0",
         "flask-cors>=4.0.0",
         "openai>=1.3.0",
+        "orjson>=3.9.0",
         "requests>=2.31.0",
         "numpy>=1.24.0"
     ]
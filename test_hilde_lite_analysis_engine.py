@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for JSONStreamScanner, which reports analyses while GPT-4's response is still streaming
+"""
+
+import json
+from typing import Any, Dict, List
+
+from hilde_lite_analysis_engine import JSONStreamScanner
+
+RESPONSE = json.dumps({
+    "positions": [
+        {"position": 0, "analyses": [{"token": "{", "explanation": "a \"quoted\" } brace [", "nested": {"a": [1, 2]}}]},
+        {"position": 3, "analyses": []},
+    ],
+    "notes": [{"text": "\\"}],
+})
+
+def _scan(chunks: List[str]) -> List[Dict[str, Any]]:
+    items: List[Dict[str, Any]] = []
+    scanner = JSONStreamScanner(items.append)
+    done = [scanner.feed(chunk) for chunk in chunks]
+    assert done[-1] and not any(done[:-1])
+    assert scanner.text() == "".join(chunks)
+    return items
+
+def test_items_match_full_parse_for_any_chunking():
+    """Every object in a top-level array is reported once, however the stream is split"""
+    expected = [item for array in json.loads(RESPONSE).values() for item in array]
+    assert _scan([RESPONSE]) == expected
+    assert _scan(list(RESPONSE)) == expected
+    for size in (2, 5, 17):
+        assert _scan([RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)]) == expected
+
+def test_stops_at_root_object():
+    """Text after the root object closes is kept but never scanned"""
+    items: List[Dict[str, Any]] = []
+    scanner = JSONStreamScanner(items.append)
+    assert scanner.feed('{"positions": [{"position": 1}]}')
+    assert scanner.feed(' {"positions": [{"position": 2}]}')
+    assert items == [{"position": 1}]
+    assert scanner.text().startswith('{"positions": [{"position": 1}]}')
+
+def test_without_callback_only_tracks_completion():
+    scanner = JSONStreamScanner()
+    assert not scanner.feed('{"positions": [{"position": 1}')
+    assert scanner.feed(']}')